@@ -1,8 +1,71 @@
+"""
+Task modules are imported on first access, so ``from fabdeploy.api import
+DefaultConf`` (e.g. in fabconf.py) does not import all of them.
+``from fabdeploy.api import *`` still imports every module.
+"""
+
 from __future__ import absolute_import
 
-from . import fabd, system, git, release, virtualenv, nginx, django, pip, \
-    postgres, mysql, supervisor, users, ssh, tar, gunicorn, uwsgi, rabbitmq, \
-    apache, redis
+import sys
+from types import ModuleType
+
 from .base import setup_fabdeploy
 from .containers import conf, DefaultConf
 from .task import Task
+
+
+_modules = [
+    'fabd',
+    'system',
+    'git',
+    'release',
+    'virtualenv',
+    'nginx',
+    'django',
+    'pip',
+    'postgres',
+    'mysql',
+    'supervisor',
+    'users',
+    'ssh',
+    'tar',
+    'gunicorn',
+    'uwsgi',
+    'rabbitmq',
+    'apache',
+    'redis',
+    'facts',
+    'multihost',
+    'scheduler',
+    'connections',
+]
+
+__all__ = _modules + ['setup_fabdeploy', 'conf', 'DefaultConf', 'Task']
+
+
+class LazyModule(ModuleType):
+    """Module that imports submodules of ``package`` on attribute access."""
+
+    def __init__(self, module, package, submodules):
+        super(LazyModule, self).__init__(module.__name__, module.__doc__)
+        self.__dict__.update(module.__dict__)
+        # original module is kept alive, so its globals are not cleared
+        self._module = module
+        self._package = package
+        self._submodules = frozenset(submodules)
+
+    def __getattr__(self, name):
+        # called only when attribute is not found, i.e. once per submodule
+        if name not in self._submodules:
+            raise AttributeError(name)
+        __import__('%s.%s' % (self._package, name))
+        module = sys.modules['%s.%s' % (self._package, name)]
+        setattr(self, name, module)
+        return module
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | self._submodules)
+
+
+sys.modules[__name__] = LazyModule(
+    sys.modules[__name__], __name__.rsplit('.', 1)[0], _modules)
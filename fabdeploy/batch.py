@@ -0,0 +1,207 @@
+"""
+Batching of remote commands.
+
+Inside :func:`batched` ``run`` and ``sudo`` calls are queued and executed
+as one remote script, so N commands cost one round trip instead of N.
+Queueing is done by ``monkey.patch_all()``; without it commands are
+executed immediately.
+"""
+
+import re
+import uuid
+from contextlib import contextmanager
+
+from fabric import operations
+from fabric.api import env, settings, hide, puts
+from fabric.operations import _AttributeString
+from fabric.state import output
+from fabric.utils import error
+
+from . import context, trace
+
+
+__all__ = ['batched']
+
+
+class BatchCommand(object):
+    def __init__(self, command, real_command):
+        self.command = command
+        # command with cd/prefix/shell_env applied when it was queued
+        self.real_command = real_command
+        self.return_code = None
+        self.output = None
+
+    @property
+    def executed(self):
+        return self.return_code is not None
+
+    @property
+    def succeeded(self):
+        return self.return_code == 0
+
+    def __repr__(self):
+        return 'BatchCommand<%r, return_code=%s>' % (
+            self.command, self.return_code)
+
+
+class Batch(object):
+    """
+    Queued commands are executed in order with ``set -e`` semantics:
+    script stops on first failed command. Exit status and output of every
+    executed command are available in ``commands``.
+
+    Commands are flushed when batch is closed, when sudo user/host/shell
+    options change or when command is run with ``warn_only`` (its result
+    is needed).
+    """
+
+    def __init__(self, run_command=None):
+        self.run_command = run_command
+        self.commands = []
+        self._pending = []
+        self._key = None
+        self.marker = '__fabd_batch_%s' % uuid.uuid4().hex
+        self._status_re = re.compile(r'^%s (\d+) (\d+)$' % self.marker)
+
+    def add(self, command, shell=True, pty=True, combine_stderr=True,
+            sudo=False, user=None, **kwargs):
+        key = (env.host_string, shell, pty, combine_stderr, sudo, user,
+               tuple(sorted(kwargs.items())))
+        if self._key != key:
+            self.flush()
+            self._key = key
+
+        real_command = operations._prefix_env_vars(
+            operations._prefix_commands(command, 'remote'))
+        cmd = BatchCommand(command, real_command)
+        self.commands.append(cmd)
+        self._pending.append(cmd)
+
+        # result is not known yet
+        out = _AttributeString('')
+        out.command = command
+        out.real_command = real_command
+        out.failed = False
+        out.succeeded = True
+        out.return_code = 0
+        out.stderr = _AttributeString('')
+        out.batch_command = cmd
+        return out
+
+    def script(self, commands):
+        lines = []
+        for i, cmd in enumerate(commands):
+            # subshell, so cd and export do not affect next commands
+            lines.append('(\n%s\n)' % cmd.real_command)
+            lines.append(
+                "_s=$?; printf '\\n%s %s %%s\\n' $_s; "
+                "[ $_s -eq 0 ] || exit $_s" % (self.marker, i))
+        return '\n'.join(lines)
+
+    def parse(self, commands, out):
+        lines = []
+        for line in out.splitlines():
+            m = self._status_re.match(line.strip())
+            if m is None:
+                lines.append(line)
+                continue
+            cmd = commands[int(m.group(1))]
+            cmd.return_code = int(m.group(2))
+            # drop newline that is printed before status
+            if lines and not lines[-1].strip():
+                lines.pop()
+            cmd.output = '\n'.join(lines)
+            lines = []
+
+    def _report(self, cmd, which):
+        # puts prefixes lines with host string
+        if output.running:
+            puts('%s: %s' % (which, cmd.command))
+        if output.stdout and cmd.output:
+            for line in cmd.output.splitlines():
+                puts('out: %s' % line)
+
+    def flush(self):
+        commands, self._pending = self._pending, []
+        if not commands:
+            return
+        host_string, shell, pty, combine_stderr, sudo, user, kwargs = \
+            self._key
+        run_command = self.run_command or operations._run_command
+
+        # commands are executed without batching, cd and prefixes
+        # are already applied
+        previous = context.current_batch()
+        context.set_batch(None)
+        try:
+            with settings(hide('running', 'stdout'),
+                          host_string=host_string,
+                          cwd='',
+                          command_prefixes=[],
+                          shell_env={},
+                          path='',
+                          warn_only=True):
+                with trace.span('batch of %s commands' % len(commands),
+                                'batch', host=host_string,
+                                commands=[c.command for c in commands]):
+                    out = run_command(
+                        self.script(commands), shell=shell, pty=pty,
+                        combine_stderr=combine_stderr, sudo=sudo, user=user,
+                        **dict(kwargs))
+        finally:
+            context.set_batch(previous)
+
+        self.parse(commands, out)
+        which = 'sudo' if sudo else 'run'
+        with settings(host_string=host_string):
+            for cmd in commands:
+                if cmd.executed:
+                    self._report(cmd, which)
+
+            failed = [cmd for cmd in commands
+                      if cmd.executed and not cmd.succeeded]
+            if failed:
+                cmd = failed[0]
+                msg = ('%s() received nonzero return code %s while '
+                       'executing batched command!\n\nRequested: %s' % (
+                           which, cmd.return_code, cmd.command))
+                error(message=msg, stdout=_AttributeString(cmd.output))
+            elif out.failed:
+                msg = '%s() received nonzero return code %s in batch!' % (
+                    which, out.return_code)
+                error(message=msg, stdout=out)
+
+    def discard(self):
+        self._pending = []
+
+
+@contextmanager
+def batched(run_command=None):
+    """
+    Context manager. Queues ``run`` and ``sudo`` calls and executes them
+    as one remote script on exit::
+
+        with batched() as batch:
+            run('rm --force %(previous_release_link)s' % conf)
+            run('touch %(release_data_file)s' % conf)
+        for cmd in batch.commands:
+            print cmd.command, cmd.return_code
+
+    Nested blocks share outer batch.
+    """
+    batch = context.current_batch()
+    if batch is not None:
+        yield batch
+        return
+
+    batch = Batch(run_command=run_command)
+    context.set_batch(batch)
+    try:
+        yield batch
+    except:
+        batch.discard()
+        raise
+    finally:
+        context.set_batch(None)
+    batch.flush()
+
@@ -0,0 +1,142 @@
+"""
+Pool of SSH connections.
+
+Fabric caches one connection per ``user@host:port``. ``monkey.patch_all()``
+turns that cache into :class:`ConnectionPool`, which connects at most once
+per key even when several threads (``fabdeploy.multihost``,
+``fabdeploy.scheduler``) need the same host, replaces connections that
+were dropped and counts how connections are used. Commands, uploads and
+sudo commands of one user reuse the connection and open new channels in
+it.
+"""
+
+import threading
+
+from fabric import state
+from fabric.api import puts
+from fabric.network import HostConnectionCache, normalize_to_string
+
+from .task import Task
+
+
+__all__ = ['stats', 'close']
+
+
+def is_active(client):
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+class ConnectionPool(HostConnectionCache):
+    def __init__(self, *args, **kwargs):
+        super(ConnectionPool, self).__init__(*args, **kwargs)
+        self._init_pool()
+
+    def _init_pool(self):
+        self._lock = threading.Lock()
+        # key -> lock that is held while connecting to key
+        self._key_locks = {}
+        # key -> {'connects': n, 'reuses': n, 'reconnects': n}
+        self._stats = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            try:
+                return self._key_locks[key]
+            except KeyError:
+                lock = self._key_locks[key] = threading.RLock()
+                return lock
+
+    def _count(self, key, name):
+        with self._lock:
+            stats = self._stats.setdefault(
+                key, {'connects': 0, 'reuses': 0, 'reconnects': 0})
+            stats[name] += 1
+
+    def connect(self, key):
+        key = normalize_to_string(key)
+        with self._key_lock(key):
+            super(ConnectionPool, self).connect(key)
+            self._count(key, 'connects')
+
+    def _get_active(self, key):
+        client = dict.get(self, key)
+        if client is not None and is_active(client):
+            self._count(key, 'reuses')
+            return client
+
+    def __getitem__(self, key):
+        key = normalize_to_string(key)
+        client = self._get_active(key)
+        if client is not None:
+            return client
+
+        with self._key_lock(key):
+            # other thread could connect while we waited for lock
+            client = self._get_active(key)
+            if client is not None:
+                return client
+
+            client = dict.get(self, key)
+            if client is not None:
+                self._count(key, 'reconnects')
+                client.close()
+            self.connect(key)
+            return dict.__getitem__(self, key)
+
+    def stats(self):
+        """Return ``{key: {'connects': n, 'reuses': n, ...}}``."""
+        with self._lock:
+            stats = dict((key, dict(s)) for key, s in self._stats.items())
+        for key, s in stats.items():
+            client = dict.get(self, key)
+            s['active'] = client is not None and is_active(client)
+        return stats
+
+    def close(self, key=None):
+        keys = [normalize_to_string(key)] if key else list(self.keys())
+        for key in keys:
+            with self._key_lock(key):
+                client = dict.get(self, key)
+                if client is not None:
+                    client.close()
+                    dict.__delitem__(self, key)
+
+
+def patch_connections():
+    """Make Fabric connection cache a :class:`ConnectionPool`."""
+    connections = state.connections
+    if not isinstance(connections, ConnectionPool):
+        # Fabric modules imported the cache object itself
+        connections.__class__ = ConnectionPool
+        connections._init_pool()
+
+
+class Stats(Task):
+    """Print how SSH connections were used."""
+
+    def do(self):
+        connections = state.connections
+        if not isinstance(connections, ConnectionPool):
+            puts('Connection pool is not enabled, see monkey.patch_all().')
+            return
+        for key, s in sorted(connections.stats().items()):
+            puts('%s: %s connects, %s reuses, %s reconnects%s' % (
+                key, s['connects'], s['reuses'], s['reconnects'],
+                '' if s['active'] else ' (closed)'))
+
+stats = Stats()
+
+
+class Close(Task):
+    """Close all SSH connections."""
+
+    def do(self):
+        if isinstance(state.connections, ConnectionPool):
+            state.connections.close()
+        else:
+            for key in list(state.connections.keys()):
+                state.connections[key].close()
+                del state.connections[key]
+
+close = Close()
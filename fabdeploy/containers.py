@@ -1,13 +1,23 @@
 import os
+import re
 import sys
+import json
+import time
 import datetime
 import posixpath
 import logging
+import weakref
+import itertools
+import threading
+from abc import ABCMeta
+from types import MethodType
+from contextlib import contextmanager
 from collections import MutableMapping
 
 from fabric import network
 from fabric.api import prompt
 
+from . import context
 from .utils import home_path
 
 
@@ -26,6 +36,10 @@ class MissingVarException(Exception):
     pass
 
 
+class CircularVarException(Exception):
+    pass
+
+
 def conf(func):
     """Decorator to mark function as config source."""
 
@@ -33,39 +47,350 @@ def conf(func):
     return func
 
 
+_generations = itertools.count()
+
+
+class KeyProfile(object):
+    def __init__(self, name):
+        self.name = name
+        # number of resolutions, i.e. cache misses
+        self.count = 0
+        self.hits = 0
+        # time spent resolving key including keys it depends on
+        self.total_time = 0.0
+        # time spent in key itself (e.g. in its @conf function)
+        self.own_time = 0.0
+        # where value came from: task name, 'conf' or 'class' -> count
+        self.sources = {}
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'hits': self.hits,
+            'total_time': self.total_time,
+            'own_time': self.own_time,
+            'sources': self.sources,
+        }
+
+
+class ConfProfile(object):
+    """Statistics of conf key resolution, see :func:`profile_conf`."""
+
+    def __init__(self):
+        self.keys = {}
+        self._lock = threading.Lock()
+        self._local = context.ThreadStack()
+
+    def _key(self, name):
+        try:
+            return self.keys[name]
+        except KeyError:
+            return self.keys.setdefault(name, KeyProfile(name))
+
+    def _stack(self):
+        return self._local.stack
+
+    def hit(self, name):
+        with self._lock:
+            self._key(name).hits += 1
+
+    def source(self, name, source):
+        with self._lock:
+            sources = self._key(name).sources
+            sources[source] = sources.get(source, 0) + 1
+
+    def enter(self):
+        # [start time, time spent in nested keys]
+        self._stack().append([time.time(), 0.0])
+
+    def leave(self, name):
+        stack = self._stack()
+        start, nested = stack.pop()
+        elapsed = time.time() - start
+        if stack:
+            stack[-1][1] += elapsed
+        with self._lock:
+            key = self._key(name)
+            key.count += 1
+            key.total_time += elapsed
+            key.own_time += elapsed - nested
+
+    def top(self, limit=20, order_by='own_time'):
+        keys = sorted(self.keys.values(),
+                      key=lambda k: getattr(k, order_by), reverse=True)
+        return keys[:limit]
+
+    def as_dict(self):
+        return dict((k.name, k.as_dict()) for k in self.keys.values())
+
+    def dump(self, path):
+        with open(path, 'wt') as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+
+
+# current ConfProfile; None when profiling is disabled
+_profile = None
+
+
+@contextmanager
+def profile_conf():
+    """
+    Context manager. Records resolution of conf keys in all confs::
+
+        with profile_conf() as profile:
+            deploy()
+        for key in profile.top(10):
+            print key.name, key.count, key.own_time
+
+    """
+    global _profile
+    previous = _profile
+    _profile = profile = ConfProfile()
+    try:
+        yield profile
+    finally:
+        _profile = previous
+
+
+_directive_re = re.compile(
+    r'%(?:\(([^)]*)\))?'
+    r'([#0 +-]*(?:\d+)?(?:\.\d+)?[hlL]?)'
+    r'([diouxXeEfFgGcrs%])?')
+
+
+class Template(object):
+    """
+    String with ``%(name)s`` directives split into literal and key segments.
+
+    Strings that can not be formatted with mapping (e.g. ``'%Y.%m.%d'``)
+    are rendered as is.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.segments = []
+        self.keys = ()
+        self.tail = source
+        self._parse(source)
+
+    def _parse(self, source):
+        segments, literal, pos = [], [], 0
+        while True:
+            i = source.find('%', pos)
+            if i == -1:
+                literal.append(source[pos:])
+                break
+            literal.append(source[pos:i])
+
+            match = _directive_re.match(source, i)
+            key, flags, conversion = match.groups()
+            if conversion == '%' and key is None and not flags:
+                literal.append('%')
+            elif conversion is None or conversion == '%' or key is None:
+                # same as ValueError/TypeError on ``source % conf``
+                return
+            else:
+                segments.append(
+                    (''.join(literal), key, '%' + flags + conversion))
+                literal = []
+            pos = match.end()
+
+        self.segments = segments
+        self.keys = tuple([key for _, key, _ in segments])
+        self.tail = ''.join(literal)
+
+    def render(self, conf):
+        if not self.segments:
+            return self.tail
+        parts = []
+        for literal, key, format in self.segments:
+            parts.append(literal)
+            parts.append(format % (conf[key],))
+        parts.append(self.tail)
+        return ''.join(parts)
+
+    def __repr__(self):
+        return 'Template(%r)' % self.source
+
+
+_templates = {}
+
+
+def compile_template(source):
+    try:
+        return _templates[source]
+    except KeyError:
+        template = _templates[source] = Template(source)
+        return template
+
+
+def template_keys(value):
+    """Return keys that are referenced by value templates."""
+    if isinstance(value, basestring):
+        return compile_template(value).keys
+    if isinstance(value, list):
+        keys = ()
+        for v in value:
+            keys += template_keys(v)
+        return keys
+    return ()
+
+
+def key_prefixes(key):
+    """Return namespaces of key, e.g. ``a__`` and ``a__b__`` for ``a__b__c``."""
+    prefixes = []
+    i = key.find('__', 1)
+    while i != -1:
+        prefixes.append(key[:i + 2])
+        i = key.find('__', i + 1)
+    return prefixes
+
+
+def _index_prefixes(index, key):
+    for prefix in key_prefixes(key):
+        index.setdefault(prefix, []).append(key)
+
+
+def _sort_graph(graph, cls_name):
+    order, done, path = [], set(), []
+
+    def visit(key):
+        if key in done:
+            return
+        if key in path:
+            cycle = path[path.index(key):] + [key]
+            raise CircularVarException(
+                '%s: %s' % (cls_name, ' -> '.join(cycle)))
+        path.append(key)
+        for dep in graph.get(key, ()):
+            visit(dep)
+        path.pop()
+        done.add(key)
+        if key in graph:
+            order.append(key)
+
+    for key in sorted(graph):
+        visit(key)
+    return order
+
+
+class ConfMeta(ABCMeta):
+    """
+    Compiles class level templates into key dependency graph.
+
+    Circular references are reported when conf class is defined.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(ConfMeta, cls).__init__(name, bases, attrs)
+        cls._conf_graph = {}
+        cls._conf_order = ()
+        cls._conf_prefixes = {}
+
+        if not [b for b in bases if isinstance(b, ConfMeta)]:
+            return
+
+        graph = {}
+        for key in dir(cls):
+            if not _is_conf_key(key):
+                continue
+            graph[key] = template_keys(getattr(cls, key))
+
+        missing = set()
+        for keys in graph.values():
+            missing.update([k for k in keys if k not in graph])
+        if missing:
+            logger.debug('%s: templates refer to unknown keys %s' %
+                         (name, ', '.join(sorted(missing))))
+
+        cls._conf_graph = graph
+        cls._conf_order = tuple(_sort_graph(graph, name))
+
+        prefixes = {}
+        for key in cls._conf_order:
+            _index_prefixes(prefixes, key)
+        cls._conf_prefixes = prefixes
+
+
 class BaseConf(MutableMapping):
+    __metaclass__ = ConfMeta
+
     _attrs = (
         '_name',
         '_tasks',
         '_global_conf',
         '_releases',
-        '_conf_value',
-        '_conf_raw_value',
-        '_process_conf',
-        '_substitute')
+        '_values',
+        '_parent',
+        '_children',
+        '_keys',
+        '_key_set',
+        '_prefixes',
+        '_cache',
+        '_dependents',
+        '_generation')
 
     def __init__(
         self,
         name=None,
         tasks=None,
         global_conf=None,
-        releases=['current', 'last', 'previous']):
+        releases=['current', 'last', 'previous'],
+        parent=None):
+        # values set on this conf; other values are looked up in parent confs
+        self._values = {}
+        self._parent = parent
+        self._children = {}
+        # index of keys of this conf and its parents; built on first use
+        self._keys = None
+        self._key_set = None
+        # namespace -> keys set on this conf, e.g. 'mysql__' -> ['mysql__db_port']
+        self._prefixes = {}
+
+        # resolved values and reverse dependencies between them:
+        # _dependents[name] is a set of keys that used name during resolution
+        self._cache = {}
+        self._dependents = {}
+        # changed on every invalidation; keys that are being resolved are
+        # tracked per thread by fabdeploy.context
+        self._generation = next(_generations)
+
         self._name = name or 'unknown'
         self._tasks = tasks or []
-        self._global_conf = global_conf or self
+        if global_conf is None:
+            global_conf = self
+        self._global_conf = global_conf
         self._releases = releases
 
+        if parent is not None:
+            parent._add_child(self)
+            return
+
         for r in self._releases:
             self['%s_release' % r] = \
-                lambda self, path_name: self._make_release(r, path_name)
+                lambda self, path_name, r=r: self._make_release(r, path_name)
 
-        self._copy_conf(self)
+        for k in self.__class__._conf_order:
+            self._new_conf(k, None)
+
+    def _add_child(self, child):
+        key = id(child)
+        children = self._children
+        children[key] = weakref.ref(
+            child, lambda ref: children.pop(key, None))
+
+    def _iter_children(self):
+        for ref in self._children.values():
+            child = ref()
+            if child is not None:
+                yield child
 
     def set_name(self, name):
         self._name = name
 
     def add_task(self, task):
         self._tasks.append(task)
+        self._invalidate_all()
 
     def set_global_conf(self, conf):
         self._global_conf = conf
@@ -82,18 +407,13 @@ class BaseConf(MutableMapping):
 
     def _substitute(self, value):
         if isinstance(value, list):
-            for i, v in enumerate(value):
-                value[i] = self._substitute(v)
+            value = [self._substitute(v) for v in value]
         elif isinstance(value, basestring):
-            value = value % self
+            value = compile_template(value).render(self)
         return value
 
     def _process_conf(self, name, value):
-        try:
-            value = self._substitute(value)
-        except ValueError:
-            logger.debug(
-                '_process_conf: can not substitute %r=%r' % (name, value))
+        value = self._substitute(value)
 
         if callable(value) and hasattr(value, '_is_conf'):
             value = value()
@@ -107,18 +427,74 @@ class BaseConf(MutableMapping):
 
         return value
 
+    def _layer_value(self, name):
+        conf = self
+        while conf is not None:
+            values = conf._values
+            if name in values:
+                return values[name]
+            conf = conf._parent
+        raise KeyError(name)
+
     def _conf_raw_value(self, name):
+        profile = _profile
         for task in self._tasks:
             try:
-                return task.conf_value(name)
+                value = task.conf_value(name)
             except MissingVarException:
                 continue
+            if profile is not None:
+                profile.source(name, '%s.%s' % (task._get_module(), task.name))
+            return value
         try:
-            return super(BaseConf, self).__getattribute__(name)
+            value = self._layer_value(name)
+        except KeyError:
+            pass
+        else:
+            if profile is not None:
+                profile.source(name, 'conf')
+            # functions are bound to the conf that resolves them
+            if callable(value) and not isinstance(value, MethodType):
+                value = MethodType(value, self, self.__class__)
+            return value
+        try:
+            value = super(BaseConf, self).__getattribute__(name)
         except AttributeError:
             raise MissingVarException
+        if profile is not None:
+            profile.source(name, 'class')
+        return value
 
-    def _conf_value(self, name, use_prompt=False):
+    def _resolving(self):
+        r = context.resolution(self, create=False)
+        if r is None:
+            return ()
+        return r.stack
+
+    def _depend(self, name):
+        r = context.resolution(self, create=False)
+        if r is not None and r.stack:
+            dependent = r.stack[-1]
+            if dependent != name:
+                self._dependents.setdefault(name, set()).add(dependent)
+
+    def _invalidate(self, name):
+        self._generation = next(_generations)
+        self._cache.pop(name, None)
+        # list() copies the set atomically, other threads may add to it
+        for dependent in list(self._dependents.pop(name, ())):
+            self._invalidate(dependent)
+        for child in self._iter_children():
+            child._invalidate(name)
+
+    def _invalidate_all(self):
+        self._generation = next(_generations)
+        self._cache.clear()
+        self._dependents.clear()
+        for child in self._iter_children():
+            child._invalidate_all()
+
+    def _resolve(self, name, use_prompt=False):
         try:
             value = self._conf_raw_value(name)
         except MissingVarException:
@@ -129,6 +505,45 @@ class BaseConf(MutableMapping):
                 raise
         return self._process_conf(name, value)
 
+    def _conf_value(self, name, use_prompt=False):
+        self._depend(name)
+        profile = _profile
+        try:
+            value = self._cache[name]
+        except KeyError:
+            pass
+        else:
+            if profile is not None:
+                profile.hit(name)
+            return value
+
+        # Value that is resolved while the same key is being resolved
+        # (e.g. ``self.conf.get('command')`` inside ``command`` task conf)
+        # skips the task, so it is not cached. Values that changed conf during
+        # resolution (e.g. ``release``) are not cached either.
+        r = context.resolution(self)
+        reentrant = name in r.stack
+        if reentrant:
+            r.reentrant += 1
+        generation = self._generation
+        r.stack.append(name)
+        if profile is not None:
+            profile.enter()
+        try:
+            value = self._resolve(name, use_prompt=use_prompt)
+        finally:
+            if profile is not None:
+                profile.leave(name)
+            r.stack.pop()
+            if reentrant:
+                r.reentrant -= 1
+            if not r.stack:
+                context.release_resolution(self)
+
+        if not r.reentrant and generation == self._generation:
+            self._cache[name] = value
+        return value
+
     def _links(self, name, value):
         parts = name.split('_')
         if parts[-1] != 'path':
@@ -138,32 +553,92 @@ class BaseConf(MutableMapping):
         links = {}
         for r in self._releases:
             links['%s_%s_link' % (r, link_name)] = \
-                conf(lambda self, conf=self, r=r: conf._make_release(r, name))
+                conf(lambda self, r=r: self._make_release(r, name))
         return links
 
     def set_conf_value(self, name, value, keep_user_value=False):
         if hasattr(self.__class__, name) and keep_user_value:
             return
 
-        instancemethod = type(self.__class__.set_conf_value)
-        if callable(value) and not isinstance(value, instancemethod):
-            value = instancemethod(value, self, self.__class__)
-
-        super(BaseConf, self).__setattr__(name, value)
+        if name not in self._values:
+            self._add_key(name)
+            _index_prefixes(self._prefixes, name)
+        self._values[name] = value
+        self._invalidate(name)
         self._new_conf(name, value)
 
     def _new_conf(self, name, value):
         for link_name, link in self._links(name, value).items():
             self.set_conf_value(link_name, link, keep_user_value=True)
 
+    def _build_keys(self):
+        # class keys go first in dependency order
+        cls = self.__class__
+        keys = list(cls._conf_order)
+        key_set = set(keys)
+        conf = self
+        while conf is not None:
+            for k in conf._values:
+                if k not in key_set and _is_conf_key(k):
+                    key_set.add(k)
+                    keys.append(k)
+            conf = conf._parent
+        self._keys = keys
+        self._key_set = key_set
+
+    def _add_key(self, name):
+        if self._keys is not None and name not in self._key_set and \
+           _is_conf_key(name):
+            self._key_set.add(name)
+            self._keys.append(name)
+        for child in self._iter_children():
+            child._add_key(name)
+
     def _conf_keys(self):
-        builtins = set([k for k in dir(BaseConf)])
-        keys = [k for k in dir(self)
-                if not k.startswith('_') and k not in builtins]
+        if self._keys is None:
+            self._build_keys()
+        if not self._tasks:
+            return self._keys
+
+        keys = list(self._keys)
+        key_set = set(self._key_set)
         for task in self._tasks:
-            keys.extend(task.conf_keys())
+            for k in task.conf_keys():
+                if k not in key_set:
+                    key_set.add(k)
+                    keys.append(k)
         return keys
 
+    def _prefixed_keys(self, namespace):
+        keys = set(self.__class__._conf_prefixes.get(namespace, ()))
+        conf = self
+        while conf is not None:
+            keys.update(conf._prefixes.get(namespace, ()))
+            conf = conf._parent
+        for task in self._tasks:
+            keys.update([k for k in task.conf_keys()
+                         if k.startswith(namespace)])
+
+        if not namespace.endswith('__'):
+            # namespace is not indexed
+            keys.update([k for k in self._conf_keys()
+                         if k.startswith(namespace)])
+        return keys
+
+    def unprefix(self, namespaces):
+        """
+        Make ``<namespace><name>`` keys available as ``<name>``.
+
+        Later namespaces take precedence. Values are aliased, so they are
+        resolved only when used.
+        """
+        for namespace in namespaces:
+            for key in self._prefixed_keys(namespace):
+                name = key[len(namespace):]
+                if not name:
+                    continue
+                self.set_conf_value(name, _Alias(name, key, self))
+
     def setdefault(self, key, default=None):
         try:
             value = self._conf_raw_value(key)
@@ -204,7 +679,7 @@ class BaseConf(MutableMapping):
             return False
 
     def __getattribute__(self, name):
-        if name in super(BaseConf, self).__getattribute__('_attrs'):
+        if name in _BUILTINS:
             return super(BaseConf, self).__getattribute__(name)
         try:
             return self._conf_value(name)
@@ -217,25 +692,81 @@ class BaseConf(MutableMapping):
             return
         self.set_conf_value(name, value)
 
-    def _copy_conf(self, source):
-        for k in source._conf_keys():
-            try:
-                self.set_conf_value(k, source._conf_raw_value(k))
-            except MissingVarException:
-                logger.debug('_copy_conf: can not copy name=%s' % k)
-
     def copy(self):
-        d = self.__class__(
+        """
+        Return conf that is layered on top of this one.
+
+        Values set on the copy are not visible in this conf, while values
+        of this conf are looked up lazily by the copy.
+        """
+        return self.__class__(
             global_conf=self._global_conf,
-            tasks=self._tasks,
-            name=self._name)
-        d._copy_conf(self)
-        return d
+            tasks=list(self._tasks),
+            name=self._name,
+            releases=self._releases,
+            parent=self)
 
     def __repr__(self):
         return '%s<name=%s>' % (self.__class__.__name__, self._name)
 
 
+# BaseConf methods and internal attributes are never looked up as conf values
+_BUILTINS = frozenset(dir(BaseConf)) | frozenset(BaseConf._attrs)
+
+
+def _is_conf_key(name):
+    return not name.startswith('_') and name not in _BUILTINS
+
+
+class _Alias(object):
+    """
+    Conf function that returns value of ``key`` as ``name``.
+
+    Value shadowed by alias is used when ``key`` refers to ``name``, e.g.
+    ``my_task__log_path = ['%(log_path)s', 'my_task']``.
+    """
+
+    _is_conf = True
+
+    def __init__(self, name, key, conf):
+        self.name = name
+        self.key = key
+        try:
+            self.shadowed = conf._layer_value(name)
+        except KeyError:
+            self.shadowed = _class_value(conf.__class__, name)
+
+    def __call__(self, conf):
+        if self.name not in conf._resolving()[:-1]:
+            return conf[self.key]
+
+        value = self.shadowed
+        if value is _missing:
+            raise KeyError(self.name)
+        if isinstance(value, _Alias):
+            return value(conf)
+        if callable(value) and not isinstance(value, MethodType):
+            value = MethodType(value, conf, conf.__class__)
+        return conf._process_conf(self.name, value)
+
+
+_missing = object()
+
+
+def _class_value(cls, name):
+    for klass in cls.__mro__:
+        if name in klass.__dict__:
+            return klass.__dict__[name]
+    return _missing
+
+
+def _host_fact(conf, name):
+    from fabdeploy import system
+    with system.facts.tmp_conf():
+        conf.set_globally(name, system.facts.get(name))
+    return conf[name]
+
+
 class DefaultConf(BaseConf):
     address = '%s@localhost' % os.environ['USER']
     instance_name = '%(user)s'
@@ -250,7 +781,9 @@ class DefaultConf(BaseConf):
     home_path = conf(lambda self: home_path(self.user))
     releases_path = ['%(home_path)s', 'releases']
     release_path = ['%(releases_path)s', '%(release)s']
-    release_data_file = ['%(release_path)s', '.fabdeploy']
+    release_data_filename = '.fabdeploy'
+    trash_path = ['%(home_path)s', 'trash']
+    release_data_file = ['%(release_path)s', '%(release_data_filename)s']
     project_path = ['%(release_path)s', '%(project_dir)s']
     django_path = ['%(project_path)s', '%(django_dir)s']
     env_path = ['%(release_path)s', 'env']
@@ -274,6 +807,31 @@ class DefaultConf(BaseConf):
     server_name = '%(host)s'
     server_admin = 'admin@%(host)s'
 
+    # facts about remote hosts (cpu_count, os, mem_total, ...) are cached
+    # locally for facts_ttl seconds, see fabdeploy.facts
+    facts_cache_lpath = os.path.expanduser('~/.fabdeploy/facts')
+    facts_ttl = 24 * 60 * 60
+    # versions of these packages are available as installed_packages
+    facts_packages = [
+        'apache2',
+        'mysql-server*',
+        'nginx',
+        'postgresql',
+        'rabbitmq-server',
+        'redis-server',
+        'supervisor',
+    ]
+
+    # see fabdeploy.multihost; on_error is 'abort' or 'continue'
+    parallel_hosts = conf(lambda self: [self.address])
+    parallel_pool_size = 10
+    parallel_on_error = 'abort'
+    # max number of tasks that fabdeploy.scheduler runs at once on one host
+    task_concurrency = 4
+    # digests of inputs of tasks with skip_unchanged, see fabdeploy.digests
+    task_digests_file = ['%(var_path)s', 'fabdeploy_digests.json']
+    use_digests = True
+
     apache_processes = 1
     # conf decorator is used to achieve lazy evaluation
     apache_threads = conf(lambda self: self.cpu_count * 2 + 1)
@@ -334,19 +892,16 @@ class DefaultConf(BaseConf):
         self.set_globally('release', self.current_time)
         return self.release
 
-    @conf
-    def os(self):
-        from fabdeploy import system
-        with system.os_codename.tmp_conf():
-            self.set_globally('os', system.os_codename.os_codename())
-        return self.os
-
-    @conf
-    def cpu_count(self):
-        from fabdeploy import system
-        with system.cpu_count.tmp_conf():
-            self.set_globally('cpu_count', system.cpu_count.cpu_count())
-        return self.cpu_count
+    # facts about remote host are gathered with one remote command
+    os = conf(lambda self: _host_fact(self, 'os'))
+    cpu_count = conf(lambda self: _host_fact(self, 'cpu_count'))
+    mem_total = conf(lambda self: _host_fact(self, 'mem_total'))
+    mem_available = conf(lambda self: _host_fact(self, 'mem_available'))
+    disk_free = conf(lambda self: _host_fact(self, 'disk_free'))
+    python_version = conf(lambda self: _host_fact(self, 'python_version'))
+    init_system = conf(lambda self: _host_fact(self, 'init_system'))
+    installed_packages = conf(
+        lambda self: _host_fact(self, 'installed_packages'))
 
     def config_template_lpath(self, name):
         for dir in self.config_templates_lpathes:
@@ -0,0 +1,183 @@
+"""
+Per-thread fabdeploy state.
+
+Conf resolution state, task confs and (inside :func:`local_env`) Fabric
+``env`` values such as ``env.conf`` and ``env.host_string`` are kept per
+thread, so tasks can run for several hosts concurrently.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from fabric import state
+from fabric.utils import _AttributeDict
+
+
+__all__ = ['local_env', 'patch_env']
+
+
+class Resolution(object):
+    """Keys of one conf that are being resolved in current thread."""
+
+    def __init__(self):
+        self.stack = []
+        self.reentrant = 0
+
+
+class _Local(threading.local):
+    def __init__(self):
+        # Fabric env values that are set in this thread only
+        self.env = None
+        # names resolved by Task.conf_value; guards against recursion
+        self.conf_names = set()
+        # task -> (conf, task_kwargs)
+        self.tasks = {}
+        # id(conf) -> Resolution
+        self.resolutions = {}
+        # commands are queued here inside batch.batched()
+        self.batch = None
+        # (stdout, stderr) that capture output of current thread
+        self.streams = None
+
+_local = _Local()
+
+
+class ThreadStack(threading.local):
+    """Stack that is separate for every thread, e.g. of running tasks."""
+
+    def __init__(self):
+        self.stack = []
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+# returned by trace.span() and counters.task() when they are disabled
+null_context = _NullContext()
+
+
+def conf_names():
+    return _local.conf_names
+
+
+def task_state(task):
+    return _local.tasks.get(task, (None, {}))
+
+
+def set_task_state(task, conf, task_kwargs):
+    if conf is None and not task_kwargs:
+        _local.tasks.pop(task, None)
+    else:
+        _local.tasks[task] = (conf, task_kwargs)
+
+
+def resolution(conf, create=True):
+    key = id(conf)
+    r = _local.resolutions.get(key)
+    if r is None and create:
+        r = _local.resolutions[key] = Resolution()
+    return r
+
+
+def release_resolution(conf):
+    _local.resolutions.pop(id(conf), None)
+
+
+def current_batch():
+    return _local.batch
+
+
+def set_batch(batch):
+    _local.batch = batch
+
+
+def output_streams():
+    return _local.streams
+
+
+def set_output_streams(streams):
+    _local.streams = streams
+
+
+class ContextEnv(_AttributeDict):
+    """Fabric env that reads and writes thread values first."""
+
+    def __getitem__(self, key):
+        local = _local.env
+        if local is not None and key in local:
+            return local[key]
+        return super(ContextEnv, self).__getitem__(key)
+
+    def __setitem__(self, key, value):
+        local = _local.env
+        if local is not None:
+            local[key] = value
+        else:
+            super(ContextEnv, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        local = _local.env
+        if local is not None:
+            # values of other threads are never deleted
+            local.pop(key, None)
+        else:
+            super(ContextEnv, self).__delitem__(key)
+
+    def __contains__(self, key):
+        local = _local.env
+        if local is not None and key in local:
+            return True
+        return super(ContextEnv, self).__contains__(key)
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+
+def patch_env():
+    """Make Fabric env aware of :func:`local_env`."""
+    if not isinstance(state.env, ContextEnv):
+        # env.__setattr__ sets dict keys
+        object.__setattr__(state.env, '__class__', ContextEnv)
+
+
+@contextmanager
+def local_env(**values):
+    """
+    Context manager. Fabric env values set inside it (including values set
+    by ``settings``, ``cd``, ``Task.tmp_conf``) are visible only in current
+    thread::
+
+        with local_env(conf=conf.copy(), host_string='user@host'):
+            release.activate.run()
+
+    """
+    patch_env()
+    previous = _local.env
+    if previous is None:
+        _local.env = dict(values)
+    else:
+        _local.env = dict(previous, **values)
+    try:
+        yield
+    finally:
+        _local.env = previous
@@ -0,0 +1,148 @@
+"""
+Counting of remote commands, uploads and uploaded bytes.
+
+Counts are collected inside :func:`counting` by ``monkey.patch_all()``
+hooks, in total and per task and host. Task can declare ``budget``, e.g.
+``budget = {'commands': 2}``; runs that exceed it are reported::
+
+    with counting() as counter:
+        release.activate.run()
+    assert not counter.violations
+
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+
+from fabric.api import env
+
+from .context import ThreadStack, null_context
+
+
+__all__ = ['counting']
+
+
+logger = logging.getLogger('fabdeploy.counters')
+
+
+KINDS = ('commands', 'uploads', 'bytes')
+
+
+class Counts(object):
+    def __init__(self):
+        self.commands = 0
+        self.uploads = 0
+        self.bytes = 0
+
+    def as_dict(self):
+        return dict((kind, getattr(self, kind)) for kind in KINDS)
+
+    def __repr__(self):
+        return 'Counts<commands=%s, uploads=%s, bytes=%s>' % (
+            self.commands, self.uploads, self.bytes)
+
+
+class Violation(object):
+    def __init__(self, task, host, kind, used, budget):
+        self.task = task
+        self.host = host
+        self.kind = kind
+        self.used = used
+        self.budget = budget
+
+    def __str__(self):
+        return '%s on %s: %s %s, budget is %s' % (
+            self.task, self.host, self.used, self.kind, self.budget)
+
+
+class Counter(object):
+    def __init__(self):
+        self.total = Counts()
+        self.tasks = {}
+        self.hosts = {}
+        self.violations = []
+        self._lock = threading.Lock()
+        self._local = ThreadStack()
+
+    def _stack(self):
+        return self._local.stack
+
+    def _counts(self, host):
+        # all counts that are changed by one remote call; nested tasks are
+        # counted in every task that runs them
+        counts = [self.total]
+        if host not in self.hosts:
+            self.hosts[host] = Counts()
+        counts.append(self.hosts[host])
+        names = set()
+        for name, run_counts, _ in self._stack():
+            counts.append(run_counts)
+            if name not in names:
+                names.add(name)
+                if name not in self.tasks:
+                    self.tasks[name] = Counts()
+                counts.append(self.tasks[name])
+        return counts
+
+    def add(self, commands=0, uploads=0, bytes=0):
+        with self._lock:
+            for counts in self._counts(env.host_string):
+                counts.commands += commands
+                counts.uploads += uploads
+                counts.bytes += bytes
+
+    @contextmanager
+    def task(self, name, budget):
+        stack = self._stack()
+        run_counts = Counts()
+        stack.append((name, run_counts, budget))
+        try:
+            yield run_counts
+        finally:
+            stack.pop()
+        if budget:
+            self.check(name, run_counts, budget)
+
+    def check(self, name, counts, budget):
+        for kind, limit in sorted(budget.items()):
+            used = getattr(counts, kind)
+            if used > limit:
+                v = Violation(name, env.host_string, kind, used, limit)
+                logger.warning('Task is over budget: %s' % v)
+                with self._lock:
+                    self.violations.append(v)
+
+
+# current Counter; None when counting is disabled
+_counter = None
+
+
+def task(name, budget=None):
+    """Context manager. Counts calls inside it as calls of task ``name``."""
+    counter = _counter
+    if counter is None:
+        return null_context
+    return counter.task(name, budget)
+
+
+def add(**counts):
+    counter = _counter
+    if counter is not None:
+        counter.add(**counts)
+
+
+def enabled():
+    return _counter is not None
+
+
+@contextmanager
+def counting():
+    """Context manager. Counts remote calls made inside it."""
+    global _counter
+    previous = _counter
+    _counter = counter = Counter()
+    try:
+        yield counter
+    finally:
+        _counter = previous
@@ -0,0 +1,176 @@
+"""
+Skipping of tasks whose inputs did not change.
+
+Task that sets ``skip_unchanged = True`` is skipped when digest of its
+inputs is the same as after its last successful run on current host::
+
+    class PushUwsgiConfig(PushConfigTask):
+        skip_unchanged = True
+        inputs = ['config', 'enabled_config']
+        input_templates = ['config_template']
+
+Inputs are values of conf keys listed in ``inputs`` and config templates
+named by ``input_templates`` keys, together with values of conf keys that
+templates use. Digests are stored in remote ``task_digests_file``, which
+is read once per host. Use ``use_digests=`` task kwarg to force run.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import posixpath
+import threading
+from StringIO import StringIO
+
+from fabric import operations
+from fabric.api import env, run, settings, hide
+from jinja2 import Environment, FileSystemLoader, meta
+
+from .utils import is_true
+
+
+__all__ = ['unchanged', 'save', 'forget']
+
+
+logger = logging.getLogger('fabdeploy.digests')
+
+
+# (path, mtime) -> (source, referenced variables, referenced templates)
+_templates = {}
+
+
+def parse_template(path):
+    key = (path, os.path.getmtime(path))
+    try:
+        return _templates[key]
+    except KeyError:
+        pass
+
+    with open(path, 'rb') as f:
+        source = f.read()
+    jinja_env = Environment(loader=FileSystemLoader(os.path.dirname(path)))
+    ast = jinja_env.parse(source.decode('utf-8'))
+    variables = sorted(meta.find_undeclared_variables(ast))
+    templates = sorted([name for name in meta.find_referenced_templates(ast)
+                        if name is not None])
+    r = _templates[key] = (source, variables, templates)
+    return r
+
+
+def _template_inputs(conf, path, seen):
+    if path in seen:
+        return []
+    seen.add(path)
+
+    source, variables, templates = parse_template(path)
+    inputs = [('template', path, hashlib.sha1(source).hexdigest())]
+    for name in variables:
+        inputs.append(('var', name, repr(conf.get(name, None))))
+    # included/extended templates are looked up in the same dir
+    for name in templates:
+        included = os.path.join(os.path.dirname(path), name)
+        if os.path.exists(included):
+            inputs.extend(_template_inputs(conf, included, seen))
+    return inputs
+
+
+def task_digest(task):
+    conf = task.conf
+    inputs = []
+    for key in task.inputs:
+        inputs.append(('key', key, repr(conf.get(key, None))))
+    seen = set()
+    for key in task.input_templates:
+        name = conf.get(key, None)
+        path = name and conf.config_template_lpath(name)
+        if path is None:
+            inputs.append(('template', name, None))
+        else:
+            inputs.extend(_template_inputs(conf, path, seen))
+    data = json.dumps(sorted(inputs))
+    return hashlib.sha1(data).hexdigest()
+
+
+def task_key(task):
+    return '%s.%s' % (task._get_module(), task.name)
+
+
+class DigestState(object):
+    """Digests of tasks stored in remote JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._digests = None
+
+    def _load(self):
+        if self._digests is None:
+            with settings(hide('everything'), warn_only=True):
+                out = run('cat %s' % self.path)
+            digests = {}
+            if out.succeeded:
+                try:
+                    digests = json.loads(out)
+                except ValueError, exc:
+                    logger.debug('DigestState: %s' % exc)
+            self._digests = digests
+        return self._digests
+
+    def get(self, key):
+        with self.lock:
+            return self._load().get(key)
+
+    def set(self, key, digest):
+        with self.lock:
+            digests = self._load()
+            if digests.get(key) == digest:
+                return
+            first_write = not digests
+            digests[key] = digest
+            data = json.dumps(digests, indent=2, sort_keys=True)
+            with settings(hide('everything')):
+                if first_write:
+                    run('mkdir --parents %s' % posixpath.dirname(self.path))
+                operations.put(StringIO(data), self.path)
+
+
+# (host_string, path) -> DigestState
+_states = {}
+_states_lock = threading.Lock()
+
+
+def get_state(conf):
+    key = (env.host_string, conf.task_digests_file)
+    with _states_lock:
+        try:
+            return _states[key]
+        except KeyError:
+            state = _states[key] = DigestState(conf.task_digests_file)
+            return state
+
+
+def forget():
+    """Forget digests that were read, so they are read again."""
+    with _states_lock:
+        _states.clear()
+
+
+def enabled(conf):
+    return is_true(conf.get('use_digests', True))
+
+
+def unchanged(task):
+    """
+    Return ``(is_unchanged, digest)`` for task that is about to run.
+    """
+    digest = task_digest(task)
+    if not enabled(task.conf):
+        return False, digest
+    stored = get_state(task.conf).get(task_key(task))
+    return stored == digest, digest
+
+
+def save(task, digest):
+    if digest is not None:
+        get_state(task.conf).set(task_key(task), digest)
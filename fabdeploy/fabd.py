@@ -6,7 +6,9 @@ import logging
 from fabric.api import env, run, sudo, puts, abort, settings, hide
 
 from . import users, tar, ssh
-from .containers import conf as conf_dec
+from .containers import conf as conf_dec, profile_conf as profile_conf_ctx
+from .trace import tracing
+from .utils import get_fab_task, run_fab_task
 from .task import Task
 
 
@@ -18,6 +20,8 @@ __all__ = [
     'create_user',
     'create_configs',
     'push_bin',
+    'profile_conf',
+    'trace',
 ]
 
 
@@ -184,3 +188,76 @@ class Bin(Task):
         return ast.literal_eval(output)
 
 bin = Bin()
+
+
+class ProfileConf(Task):
+    """
+    Run task with conf profiling and print keys that took most time, e.g.
+    ``fab fabd.conf:prod fabd.profile_conf:deploy,json_lfile=conf.json``.
+    """
+
+    @conf_dec
+    def limit(self):
+        return 20
+
+    @conf_dec
+    def order_by(self):
+        return 'own_time'
+
+    @conf_dec
+    def json_lfile(self):
+        return ''
+
+    def report(self, profile):
+        out = ['%-40s %8s %8s %10s %10s  %s' % (
+            'key', 'count', 'hits', 'total ms', 'own ms', 'sources')]
+        for key in profile.top(int(self.conf.limit), self.conf.order_by):
+            sources = ', '.join(
+                '%s=%s' % item for item in sorted(key.sources.items()))
+            out.append('%-40s %8d %8d %10.1f %10.1f  %s' % (
+                key.name, key.count, key.hits,
+                key.total_time * 1000, key.own_time * 1000, sources))
+        puts('\n'.join(out))
+
+    def do(self):
+        task = get_fab_task(self.conf.task)
+        with profile_conf_ctx() as profile:
+            run_fab_task(task)
+
+        self.report(profile)
+        if self.conf.json_lfile:
+            profile.dump(self.conf.json_lfile)
+            puts('Profile is saved to %s.' % self.conf.json_lfile)
+        return profile
+
+    def run(self, task, **kwargs):
+        kwargs.setdefault('task', task)
+        return super(ProfileConf, self).run(**kwargs)
+
+profile_conf = ProfileConf()
+
+
+class Trace(Task):
+    """
+    Run task and save timings of tasks, commands and uploads in Chrome
+    trace format (chrome://tracing, Perfetto), e.g.
+    ``fab fabd.conf:prod fabd.trace:deploy,trace_lfile=deploy.json``.
+    """
+
+    @conf_dec
+    def trace_lfile(self):
+        return os.path.abspath('fabdeploy-trace.json')
+
+    def do(self):
+        task = get_fab_task(self.conf.task)
+        try:
+            with tracing(self.conf.trace_lfile):
+                return run_fab_task(task)
+        finally:
+            puts('Trace is saved to %s.' % self.conf.trace_lfile)
+
+    def run(self, task, **kwargs):
+        kwargs.setdefault('task', task)
+        return super(Trace, self).run(**kwargs)
+
+trace = Trace()
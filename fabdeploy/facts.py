@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import logging
+import datetime
+import tempfile
+import threading
+
+from fabric import network
+from fabric.api import puts
+
+from .task import Task
+
+
+__all__ = [
+    'show',
+    'refresh',
+    'clear',
+]
+
+
+logger = logging.getLogger('fabdeploy.facts')
+
+
+# held while cache file is read, changed and written, e.g. by tasks that
+# fabdeploy.scheduler runs in threads
+_lock = threading.Lock()
+
+
+class FactsCache(object):
+    """
+    Facts about remote host (number of CPUs, OS codename, memory, ...)
+    stored in local JSON file, so they are not gathered on every run.
+    """
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+
+    def _load(self):
+        try:
+            with open(self.path, 'rt') as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, data):
+        dirname = os.path.dirname(self.path)
+        try:
+            os.makedirs(dirname)
+        except OSError, exc:
+            logger.debug('FactsCache: %s' % exc)
+
+        # rename is atomic, so concurrent fab runs never see partial file
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wt') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.rename(tmp_path, self.path)
+
+    def _is_fresh(self, record):
+        return time.time() - record['time'] < self.ttl
+
+    def get(self, name):
+        record = self._load().get(name)
+        if record is None or not self._is_fresh(record):
+            raise KeyError(name)
+        return record['value']
+
+    def get_many(self, names):
+        data = self._load()
+        facts = {}
+        for name in names:
+            record = data.get(name)
+            if record is None or not self._is_fresh(record):
+                raise KeyError(name)
+            facts[name] = record['value']
+        return facts
+
+    def set(self, name, value):
+        self.update({name: value})
+
+    def update(self, facts):
+        with _lock:
+            data = self._load()
+            now = time.time()
+            for name, value in facts.items():
+                data[name] = {'value': value, 'time': now}
+            self._save(data)
+
+    def delete(self, name):
+        with _lock:
+            data = self._load()
+            if name in data:
+                del data[name]
+                self._save(data)
+
+    def items(self):
+        """Return list of ``(name, value, gathered_at, is_fresh)``."""
+        items = []
+        for name, record in sorted(self._load().items()):
+            gathered_at = datetime.datetime.fromtimestamp(record['time'])
+            items.append(
+                (name, record['value'], gathered_at, self._is_fresh(record)))
+        return items
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError, exc:
+            logger.debug('FactsCache: %s' % exc)
+
+
+def get_cache(conf):
+    _, host, port = network.normalize(conf.address)
+    path = os.path.join(conf.facts_cache_lpath, '%s_%s.json' % (host, port))
+    return FactsCache(path, conf.facts_ttl)
+
+
+class Show(Task):
+    """Print cached facts about current host."""
+
+    def do(self):
+        cache = get_cache(self.conf)
+        for name, value, gathered_at, is_fresh in cache.items():
+            if is_fresh:
+                s = '%s = %r (%s)'
+            else:
+                s = '%s = %r (%s, expired)'
+            gathered_at = gathered_at.strftime(self.conf.time_format)
+            puts(s % (name, value, gathered_at))
+
+show = Show()
+
+
+class Refresh(Task):
+    """Gather facts about current host again."""
+
+    def do(self):
+        from . import system
+
+        with system.facts.tmp_conf(self.conf):
+            facts = system.facts.refresh()
+        for name, value in sorted(facts.items()):
+            self.conf.set_globally(name, value)
+            puts('%s = %r' % (name, value))
+
+refresh = Refresh()
+
+
+class Clear(Task):
+    """Remove cached facts about current host."""
+
+    def do(self):
+        get_cache(self.conf).clear()
+
+clear = Clear()
@@ -5,6 +5,36 @@ from fabric.api import run, settings, hide, sudo
 from .utils import split_lines
 
 
+# max number of paths that are checked by one remote command
+MANY_CHUNK_SIZE = 500
+
+
+def shell_quote(s):
+    return "'%s'" % s.replace("'", "'\\''")
+
+
+def _run_script(script, use_sudo=False, shell=True):
+    func = use_sudo and sudo or run
+    if not shell:
+        # script needs shell even when caller does not want shell wrapping
+        script = 'sh -c %s' % shell_quote(script)
+    with settings(hide('everything'), warn_only=True):
+        return func(script, shell=shell)
+
+
+def _chunks(items):
+    for i in range(0, len(items), MANY_CHUNK_SIZE):
+        yield items[i:i + MANY_CHUNK_SIZE]
+
+
+def _indexed_lines(out):
+    # output can contain unrelated lines, e.g. login banner
+    for line in split_lines(out):
+        index, _, value = line.partition(' ')
+        if index.isdigit():
+            yield int(index), value
+
+
 def list_files(dirpath):
     with settings(hide('running', 'stdout')):
         # -1 - list one file per line
@@ -13,6 +43,58 @@ def list_files(dirpath):
         yield posixpath.join(dirpath, filename)
 
 
+# find -printf %y -> file type as stat reports it
+FIND_TYPES = {
+    'f': 'regular file',
+    'd': 'directory',
+    'l': 'symbolic link',
+    'p': 'fifo',
+    's': 'socket',
+    'b': 'block special file',
+    'c': 'character special file',
+}
+
+
+def _find_command(dirpath, pattern=None, regex=None, type=None):
+    cmd = 'find %s -mindepth 1 -maxdepth 1' % shell_quote(dirpath)
+    if pattern is not None:
+        cmd += ' -name %s' % shell_quote(pattern)
+    if regex is not None:
+        # regex is matched against name, find matches against whole path
+        cmd += ' -regextype posix-extended -regex %s' % shell_quote(
+            '.*/%s' % regex)
+    if type is not None:
+        cmd += ' -type %s' % type
+    return cmd + " -printf '%y|%s|%T@|%f\\n'"
+
+
+def list_dir(dirpath, pattern=None, regex=None, type=None, use_sudo=False):
+    """
+    Yield entries of ``dirpath`` as dicts with keys ``path``, ``name``,
+    ``type``, ``size`` and ``mtime`` (unix time). Entries are listed with
+    one remote command and filtered remotely: ``pattern`` is glob and
+    ``regex`` is POSIX extended regex that name must match, ``type`` is
+    find type, e.g. ``f`` or ``d``. Entries are yielded in no particular
+    order.
+    """
+    cmd = _find_command(dirpath, pattern=pattern, regex=regex, type=type)
+    func = use_sudo and sudo or run
+    with settings(hide('running', 'stdout')):
+        out = func(cmd)
+    for line in split_lines(out):
+        parts = line.split('|', 3)
+        if len(parts) != 4:
+            continue
+        type, size, mtime, name = parts
+        yield {
+            'path': posixpath.join(dirpath, name),
+            'name': name,
+            'type': FIND_TYPES.get(type, type),
+            'size': int(size),
+            'mtime': int(float(mtime)),
+        }
+
+
 def read_file(path, use_sudo=False, shell=True):
     cmd = sudo if use_sudo else run
     with settings(hide('running', 'stdout')):
@@ -40,3 +122,54 @@ def exists(path, use_sudo=False, verbose=False, shell=True):
     # Otherwise, be quiet
     with settings(hide('everything'), warn_only=True):
         return not func(cmd, shell=shell).failed
+
+
+def exists_many(paths, use_sudo=False, shell=True):
+    """
+    Return ``{path: True/False}`` for given paths. Paths are checked with
+    one remote command.
+    """
+    paths = list(paths)
+    result = dict((path, False) for path in paths)
+    for chunk in _chunks(paths):
+        script = '; '.join([
+            'test -e %s && echo "%d 1" || echo "%d 0"' % (
+                shell_quote(path), i, i)
+            for i, path in enumerate(chunk)])
+        out = _run_script(script, use_sudo=use_sudo, shell=shell)
+        for i, value in _indexed_lines(out):
+            if i < len(chunk):
+                result[chunk[i]] = value == '1'
+    return result
+
+
+def stat_many(paths, use_sudo=False, shell=True, follow=False):
+    """
+    Return ``{path: stat}`` for given paths with one remote command. Stat is
+    dict with keys ``type`` (e.g. ``directory``, ``regular file``,
+    ``symbolic link``), ``size``, ``mtime`` (unix time), ``mode`` (octal
+    string), ``owner`` and ``group``, or None when path does not exist.
+    Symbolic links are followed when ``follow`` is True.
+    """
+    paths = list(paths)
+    result = dict((path, None) for path in paths)
+    options = '--dereference ' if follow else ''
+    for chunk in _chunks(paths):
+        script = '; '.join([
+            "stat %s--format='%d %%F|%%s|%%Y|%%a|%%U|%%G' %s 2>/dev/null"
+            " || echo '%d -'" % (options, i, shell_quote(path), i)
+            for i, path in enumerate(chunk)])
+        out = _run_script(script, use_sudo=use_sudo, shell=shell)
+        for i, value in _indexed_lines(out):
+            if i >= len(chunk) or value == '-':
+                continue
+            type, size, mtime, mode, owner, group = value.split('|')
+            result[chunk[i]] = {
+                'type': type,
+                'size': int(size),
+                'mtime': int(mtime),
+                'mode': mode,
+                'owner': owner,
+                'group': group,
+            }
+    return result
@@ -1,6 +1,13 @@
+import os
+import glob
+
 from fabric import operations
+from fabric.api import env
 from fabric.contrib import files
 
+from . import context, counters, trace
+from .connections import patch_connections
+from .context import patch_env
 from .utils import sudo_user
 
 
@@ -17,14 +24,61 @@ def _patched_run_command(
     pty=True,
     combine_stderr=True,
     sudo=False,
-    user=None):
+    user=None,
+    **kwargs):
+    # kwargs are options of newer Fabric versions (quiet, warn_only, ...)
     if sudo:
         with sudo_user():
-            return _run_command(command, shell=shell, pty=pty,
-                combine_stderr=combine_stderr, sudo=sudo, user=user)
+            return _batched_run_command(command, shell=shell, pty=pty,
+                combine_stderr=combine_stderr, sudo=sudo, user=user, **kwargs)
     else:
-        return _run_command(command, shell=shell, pty=pty,
-            combine_stderr=combine_stderr, sudo=sudo, user=user)
+        return _batched_run_command(command, shell=shell, pty=pty,
+            combine_stderr=combine_stderr, sudo=sudo, user=user, **kwargs)
+
+
+def _batched_run_command(command, **kwargs):
+    batch = context.current_batch()
+    if batch is not None:
+        if not (env.warn_only or kwargs.get('warn_only') or
+                kwargs.get('quiet')):
+            return batch.add(command, **kwargs)
+        # caller needs result of command, e.g. files.exists
+        batch.flush()
+    return _traced_run_command(command, **kwargs)
+
+
+def _traced_run_command(command, **kwargs):
+    streams = context.output_streams()
+    # only Fabric versions that support stdout/stderr pass them
+    if streams is not None and 'stdout' in kwargs:
+        if kwargs['stdout'] is None:
+            kwargs['stdout'] = streams[0]
+        if kwargs.get('stderr') is None:
+            kwargs['stderr'] = streams[1]
+
+    which = 'sudo' if kwargs.get('sudo') else 'run'
+    with trace.span(command[:80], which, host=env.host_string,
+                    command=command) as args:
+        counters.add(commands=1)
+        out = _run_command(command, **kwargs)
+        if args is not None:
+            args['return_code'] = out.return_code
+        return out
+
+
+def _local_size(local_path):
+    if not isinstance(local_path, basestring):
+        # file-like object
+        return None
+    size = 0
+    for path in glob.glob(os.path.expanduser(local_path)):
+        if os.path.isdir(path):
+            for dirpath, _, filenames in os.walk(path):
+                for filename in filenames:
+                    size += os.path.getsize(os.path.join(dirpath, filename))
+        else:
+            size += os.path.getsize(path)
+    return size
 
 
 def patched_put(
@@ -32,18 +86,39 @@ def patched_put(
     remote_path=None,
     use_sudo=False,
     mirror_local_mode=False,
-    mode=None):
+    mode=None,
+    **kwargs):
+    batch = context.current_batch()
+    if batch is not None:
+        # keep order of queued commands and upload
+        batch.flush()
     if use_sudo:
         with sudo_user():
-            return put(local_path=local_path, remote_path=remote_path,
+            return _traced_put(local_path=local_path, remote_path=remote_path,
                 use_sudo=use_sudo, mirror_local_mode=mirror_local_mode,
-                mode=mode)
+                mode=mode, **kwargs)
     else:
-        return put(local_path=local_path, remote_path=remote_path,
-            use_sudo=use_sudo, mirror_local_mode=mirror_local_mode, mode=mode)
+        return _traced_put(local_path=local_path, remote_path=remote_path,
+            use_sudo=use_sudo, mirror_local_mode=mirror_local_mode, mode=mode,
+            **kwargs)
+
+
+def _traced_put(local_path=None, remote_path=None, **kwargs):
+    with trace.span('put %s' % remote_path, 'put', host=env.host_string,
+                    local_path=str(local_path),
+                    remote_path=remote_path) as args:
+        size = None
+        if args is not None or counters.enabled():
+            size = _local_size(local_path)
+        if args is not None:
+            args['bytes'] = size
+        counters.add(uploads=1, bytes=size or 0)
+        return put(local_path=local_path, remote_path=remote_path, **kwargs)
 
 
 def patch_all():
+    patch_env()
+    patch_connections()
     operations._run_command = _patched_run_command
     operations.put = patched_put
     files.put = patched_put
@@ -0,0 +1,192 @@
+import Queue
+import logging
+import threading
+
+from fabric import network
+from fabric.api import env, puts, abort
+
+from .base import setup_fabdeploy
+from .context import local_env
+from .task import ExecuteTask
+from .utils import run_fab_task, RunResult, join_thread
+
+
+__all__ = ['execute']
+
+
+logger = logging.getLogger('fabdeploy.multihost')
+
+
+class HostResult(RunResult):
+    def __init__(self, host):
+        super(HostResult, self).__init__()
+        self.host = host
+        self.results = []
+        self.skipped = False
+
+    @property
+    def result(self):
+        if self.results:
+            return self.results[-1]
+
+    def __repr__(self):
+        return 'HostResult<host=%s, failed=%s, duration=%s>' % (
+            self.host, self.failed, self.duration)
+
+
+class Executor(object):
+    """
+    Runs tasks on several hosts concurrently.
+
+    Each host gets its own conf layered on top of ``env.conf``: values set
+    with ``set_globally`` (e.g. facts like ``cpu_count``) stay in that
+    conf. Keys listed in ``shared`` (``release`` by default) are resolved
+    once before hosts are started, so all hosts use the same value.
+
+    ``on_error`` is ``'abort'`` (do not start remaining hosts) or
+    ``'continue'``.
+    """
+
+    def __init__(
+        self, hosts, pool_size=10, on_error='abort', shared=('release',)):
+        assert on_error in ('abort', 'continue')
+        self.hosts = list(hosts)
+        self.pool_size = max(1, min(pool_size, len(self.hosts)))
+        self.on_error = on_error
+        self.shared = shared
+
+    def _host_string(self, conf, host):
+        username, hostname, port = network.normalize(host)
+        if '@' not in host:
+            username = conf.user
+        return network.join_host_strings(username, hostname, port)
+
+    def _run_host(self, base_conf, host, tasks):
+        r = HostResult(host)
+        conf = base_conf.copy()
+        conf.set_global_conf(conf)
+        conf.set_name(host)
+        host_string = self._host_string(conf, host)
+        conf.address = host_string
+
+        def run_tasks():
+            with local_env(conf=conf, host_string=host_string):
+                for task in tasks:
+                    r.results.append(run_fab_task(task))
+
+        r.call(run_tasks)
+        if r.failed:
+            logger.debug('Executor: %s failed' % host, exc_info=r.exc_info)
+        return r
+
+    def _worker(self, base_conf, queue, tasks, results, stop):
+        while not stop.is_set():
+            try:
+                host = queue.get_nowait()
+            except Queue.Empty:
+                return
+            r = self._run_host(base_conf, host, tasks)
+            results[host] = r
+            if r.failed and self.on_error == 'abort':
+                stop.set()
+
+    def execute(self, tasks):
+        if not isinstance(tasks, (list, tuple)):
+            tasks = [tasks]
+        if not hasattr(env, 'conf'):
+            setup_fabdeploy()
+
+        # values of shared keys are fixed in layer that is common for hosts
+        base_conf = env.conf.copy()
+        base_conf.set_global_conf(base_conf)
+        for key in self.shared:
+            if key in base_conf:
+                base_conf[key] = base_conf[key]
+
+        queue = Queue.Queue()
+        for host in self.hosts:
+            queue.put(host)
+
+        results = {}
+        stop = threading.Event()
+        threads = []
+        for i in range(self.pool_size):
+            t = threading.Thread(
+                target=self._worker,
+                args=(base_conf, queue, tasks, results, stop))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            join_thread(t)
+
+        ordered = []
+        for host in self.hosts:
+            r = results.get(host)
+            if r is None:
+                r = HostResult(host)
+                r.skipped = True
+            ordered.append(r)
+        return ordered
+
+
+def run_tasks(tasks, hosts=None, pool_size=None, on_error=None, **kwargs):
+    """
+    Run task (or list of tasks) on hosts, ``pool_size`` hosts at a time.
+    Returns list of :class:`HostResult` in order of hosts::
+
+        @task
+        def deploy_all():
+            results = multihost.run_tasks(deploy, hosts=['web1', 'web2'])
+            multihost.report(results)
+
+    """
+    if not hasattr(env, 'conf'):
+        setup_fabdeploy()
+    if hosts is None:
+        hosts = env.conf.parallel_hosts
+    if pool_size is None:
+        pool_size = env.conf.parallel_pool_size
+    if on_error is None:
+        on_error = env.conf.parallel_on_error
+    executor = Executor(hosts, pool_size=pool_size, on_error=on_error,
+                        **kwargs)
+    return executor.execute(tasks)
+
+
+def report(results):
+    for r in results:
+        if r.skipped:
+            puts('%s: skipped' % r.host)
+        elif r.failed:
+            puts('%s: failed in %.1fs: %s' % (r.host, r.duration, r.exception))
+        else:
+            puts('%s: done in %.1fs' % (r.host, r.duration))
+
+
+class Execute(ExecuteTask):
+    """
+    Run fab tasks on ``parallel_hosts``, e.g.
+    ``fab fabd.conf:prod multihost.execute:deploy``.
+    Several tasks are separated with ``;``.
+    """
+
+    def do(self):
+        tasks = self.fab_tasks()
+
+        hosts = self.conf.parallel_hosts
+        if isinstance(hosts, basestring):
+            hosts = hosts.split(';')
+
+        results = run_tasks(
+            tasks,
+            hosts=hosts,
+            pool_size=int(self.conf.parallel_pool_size),
+            on_error=self.conf.parallel_on_error)
+        report(results)
+        failed = [r.host for r in results if r.failed]
+        if failed:
+            abort('Failed hosts: %s.' % ', '.join(failed))
+        return results
+
+execute = Execute()
@@ -49,6 +49,10 @@ class PushConfigTask(Task):
 
 
 class PushUwsgiConfig(PushConfigTask):
+    skip_unchanged = True
+    inputs = ['config', 'enabled_config']
+    input_templates = ['config_template']
+
     @conf
     def config_template(Task):
         return 'nginx_uwsgi.config'
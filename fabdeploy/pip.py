@@ -48,14 +48,22 @@ install = Install()
 class PushConfig(Task):
     """Sets up pip.conf file"""
 
+    skip_unchanged = True
+    inputs = ['home_path', 'user']
+    input_templates = ['config_template']
+
     @conf
     def home_path(self):
         return home_path(self.conf.user)
 
+    @conf
+    def config_template(self):
+        return 'pip.conf'
+
     def do(self):
         sudo('mkdir --parents %(home_path)s/.pip' % self.conf)
         upload_config_template(
-            'pip.conf',
+            self.conf.config_template,
             '%(home_path)s/.pip/pip.conf' % self.conf,
             use_sudo=True)
         sudo('chown --recursive %(user)s:%(user)s %(home_path)s/.pip' %
@@ -70,8 +70,13 @@ dump = Dump()
 
 
 class ListDumps(Task):
+    @conf
+    def dumps_pattern(self):
+        return '*.pgc'
+
     def dumps(self):
-        dumps = list(files.list_files(self.conf.backup_path))
+        dumps = [f['path'] for f in files.list_dir(
+            self.conf.backup_path, pattern=self.conf.dumps_pattern, type='f')]
         dumps.sort(reverse=True)
         return dumps
 
@@ -1,12 +1,16 @@
+import re
+import json
+import time
+import calendar
 import datetime
 import posixpath
 
-from fabric.api import run, puts, prompt
-from fabric.contrib import files
+from fabric.api import run, puts, prompt, settings, hide
 
-from .files import list_files
+from . import files
 from .containers import conf
 from .task import Task
+from .utils import split_lines, parse_size, format_size, is_true
 
 
 __all__ = [
@@ -19,6 +23,7 @@ __all__ = [
     'purge_old',
     'purge_tmp',
     'purge',
+    'purge_status',
 ]
 
 
@@ -30,14 +35,65 @@ exists = Exists()
 
 
 class Create(Task):
+    """
+    Create release. Env of last release is reused: in ``copy`` mode
+    (default) everything is copied; in ``link`` mode its files are
+    hardlinked and only files matching ``copy_patterns``, which are changed
+    in place, are copied.
+    """
+
+    budget = {'commands': 2}
+
+    @conf
+    def mode(self):
+        return 'copy'
+
+    @conf
+    def copy_patterns(self):
+        # bin/ scripts, *.pth and *.egg-link are rewritten in place
+        return ['./bin/*', '*.pth', '*.egg-link']
+
+    @conf
+    def link_command(self):
+        # hardlink everything, then replace mutable files with copies
+        where = ' -o '.join([
+            '-path %s' % files.shell_quote(p) for p in self.conf.copy_patterns])
+        return (
+            'cp --archive --link %(last_env_link)s %(release_path)s && '
+            'cd %(env_path)s && '
+            'find . -type f \\( ' + where + ' \\) -printf \'%%s\\n\' '
+            '-exec sh -c \'cp --preserve=all "$0" "$0.tmp" && '
+            'mv --force "$0.tmp" "$0"\' {} \\; | '
+            'awk \'{s += $1} END {print "copied", s + 0}\' && '
+            'find . -type f -printf \'%%s\\n\' | '
+            'awk \'{s += $1} END {print "total", s + 0}\'') % self.conf
+
+    def link_env(self):
+        with settings(hide('stdout')):
+            out = run(self.conf.link_command)
+        sizes = {'copied': 0, 'total': 0}
+        for line in split_lines(out):
+            name, _, value = line.partition(' ')
+            if name in sizes and value.isdigit():
+                sizes[name] = int(value)
+        result = {'copied': sizes['copied'],
+                  'linked': sizes['total'] - sizes['copied']}
+        puts('Env of last release: %(copied)s bytes copied, '
+             '%(linked)s bytes linked' % result)
+        return result
+
     def do(self):
-        if files.exists(posixpath.join(self.conf.env_path, 'bin')):
+        env_bin_path = posixpath.join(self.conf.env_path, 'bin')
+        exists = files.exists_many([env_bin_path, self.conf.last_env_link])
+        if exists[env_bin_path]:
             puts('Release %(release)s already exists... skipping...' %
                  self.conf)
             return
 
         if not self.conf.get('fresh', False) and \
-           files.exists(self.conf.last_env_link):
+           exists[self.conf.last_env_link]:
+            if self.conf.mode == 'link':
+                return self.link_env()
             run('cp --recursive %(last_env_link)s %(release_path)s' %
                 self.conf)
 
@@ -45,52 +101,127 @@ create = Create()
 
 
 class Activate(Task):
+    """
+    Activate release. New links are created under temporary names and
+    renamed over old ones, so ``current`` always points to some release.
+    Links are switched and release data is written with one remote
+    command; ``latency_us`` in release data is time that switch took.
+    """
+
+    budget = {'commands': 1, 'uploads': 0}
+
+    @conf
+    def activate_command(self):
+        tmp = lambda path: files.shell_quote(path + '.tmp')
+        previous = files.shell_quote(self.conf.previous_release_link)
+        last = files.shell_quote(self.conf.last_release_link)
+        current = files.shell_quote(self.conf.current_release_link)
+        release_path = files.shell_quote(self.conf.release_path)
+        return ' && '.join([
+            '_t0=$(date +%s%N)',
+            'ln --symbolic --force --no-target-directory %s %s' % (
+                release_path, tmp(self.conf.last_release_link)),
+            'ln --symbolic --force --no-target-directory %s %s' % (
+                release_path, tmp(self.conf.current_release_link)),
+            # save previous release
+            '{ if [ -L %s ]; then '
+            'cp --no-dereference --preserve=links --force '
+            '--no-target-directory %s %s && '
+            'mv --no-target-directory %s %s; '
+            'else rm --force %s; fi; }' % (
+                last, last, tmp(self.conf.previous_release_link),
+                tmp(self.conf.previous_release_link), previous, previous),
+            'mv --no-target-directory %s %s' % (
+                tmp(self.conf.last_release_link), last),
+            'mv --no-target-directory %s %s' % (
+                tmp(self.conf.current_release_link), current),
+            '_t1=$(date +%s%N)',
+            self.data_command('$(( (_t1 - _t0) / 1000 ))'),
+        ])
+
+    def data_command(self, latency):
+        # duration is time from creation of release to its activation
+        activated = int(time.time())
+        try:
+            created = calendar.timegm(time.strptime(
+                self.conf.release, self.conf.time_format))
+            duration = str(activated - created)
+        except ValueError:
+            # release is not named by time, e.g. release=v1.2
+            duration = 'null'
+        data_format = (
+            '{"release": %%s, "activated": %d, "duration": %s, '
+            '"latency_us": %%s, "commit": "%%s", "size": %%s}\\n' % (
+                activated, duration))
+        release_path = files.shell_quote(self.conf.release_path)
+        # commit and size are found by the same remote command
+        return (
+            '{ _c=$(cd %s && git rev-parse HEAD 2>/dev/null); '
+            '_s=$(du --summarize --bytes %s | cut --fields=1); '
+            'printf %s %s "%s" "$_c" "${_s:-0}" > %s; }' % (
+                release_path, release_path,
+                files.shell_quote(data_format),
+                files.shell_quote(json.dumps(self.conf.release)), latency,
+                files.shell_quote(self.conf.release_data_file)))
+
     def do(self):
-        # save previous release
-        run('rm --force %(previous_release_link)s' % self.conf)
-        if files.exists(self.conf.last_release_link):
-            run('cp '
-                '--no-dereference '
-                '--preserve=links '
-                '%(last_release_link)s %(previous_release_link)s' % self.conf)
-
-        # save last release
-        run('ln '
-            '--symbolic '
-            '--force '
-            '--no-target-directory '
-            '%(release_path)s '
-            '%(last_release_link)s' % self.conf)
-
-        # activate current release
-        run('ln '
-            '--symbolic '
-            '--force '
-            '--no-target-directory '
-            '%(release_path)s %(current_release_link)s' % self.conf)
-
-        run('touch %(release_data_file)s' % self.conf)
+        run(self.conf.activate_command)
 
 activate = Activate()
 
 
 class ListReleases(Task):
-    def releases(self):
+    """
+    List releases. Release is tmp until it is activated; data of activated
+    release is read from its ``release_data_filename`` file. Releases and
+    their data are read with one remote command.
+    """
+
+    @conf
+    def releases_script(self):
+        pattern = re.sub(r'%.', '*', self.conf.time_format)
+        return (
+            'cd %s && for _r in %s; do '
+            '[ -d "$_r" ] || continue; '
+            'if [ -f "$_r/%s" ]; then '
+            'printf \'%%s + \' "$_r"; tr --delete \'\\n\' < "$_r/%s"; '
+            'echo; '
+            'else echo "$_r -"; fi; '
+            'done' % (self.conf.releases_path, pattern,
+                      self.conf.release_data_filename,
+                      self.conf.release_data_filename))
+
+    def read_releases(self):
+        """
+        Return list of dicts with keys ``name``, ``is_tmp`` and ``data``
+        (dict), newest release first.
+        """
+        with settings(hide('running', 'stdout'), warn_only=True):
+            out = run(self.conf.releases_script)
+
         releases = []
-        for file in list_files(self.conf.home_path):
-            name = posixpath.basename(file)
+        for line in split_lines(out):
+            name, _, rest = line.partition(' ')
+            is_tmp = rest == '-'
             try:
                 datetime.datetime.strptime(name, self.conf.time_format)
             except ValueError:
                 continue
 
-            f = posixpath.join(self.conf.home_path, name, '.fabdeploy')
-            is_tmp = not files.exists(f)
-            releases.append((name, is_tmp))
+            data = {}
+            if not is_tmp and rest[1:].strip():
+                try:
+                    data = json.loads(rest[2:])
+                except ValueError:
+                    pass
+            releases.append({'name': name, 'is_tmp': is_tmp, 'data': data})
 
-        releases.sort(reverse=True)
+        releases.sort(key=lambda r: r['name'], reverse=True)
         return releases
 
+    def releases(self):
+        return [(r['name'], r['is_tmp']) for r in self.read_releases()]
+
     def puts(self, releases):
         for i, (release, is_tmp) in enumerate(releases):
             if is_tmp:
@@ -182,11 +313,44 @@ class PurgeTask(Task):
         else:
             return False
 
+    @conf
+    def purge_mode(self):
+        return 'sync'
+
+    @conf
+    def purge_rate(self):
+        # files per second that are deleted in background mode
+        return 1000
+
     def purge(self, releases):
         dirs = []
         for v in releases:
-            dirs.append(posixpath.join(self.conf.home_path, v))
-        run('rm --recursive --force ' + ' '.join(dirs))
+            dirs.append(posixpath.join(self.conf.releases_path, v))
+        if self.conf.purge_mode != 'background':
+            run('rm --recursive --force ' + ' '.join(dirs))
+            return
+
+        # renaming is instant, files are deleted by reclaimer
+        run('mkdir --parents %s && '
+            'mv --backup=numbered --target-directory=%s %s && %s' % (
+                self.conf.trash_path, self.conf.trash_path, ' '.join(dirs),
+                self.reclaim_command()), pty=False)
+
+    def reclaim_command(self):
+        """
+        Return command that deletes files in ``trash_path`` in background
+        with lowest CPU and I/O priority, at most ``purge_rate`` files per
+        second. Only one reclaimer runs at a time.
+        """
+        script = (
+            'ionice -c 3 -p $$ 2>/dev/null; '
+            'find %s -mindepth 1 -depth -print0 | '
+            'xargs --null --no-run-if-empty --max-args=%s '
+            'sh -c \'rm --force --dir -- "$@"; sleep 1\' sh' % (
+                self.conf.trash_path, int(self.conf.purge_rate)))
+        return ('{ nohup flock --nonblock %s.lock nice -n 19 sh -c %s '
+                '> /dev/null 2>&1 < /dev/null & }' % (
+                    self.conf.trash_path, files.shell_quote(script)))
 
 
 class PurgeTmp(PurgeTask):
@@ -206,27 +370,173 @@ purge_tmp = PurgeTmp()
 
 
 class PurgeOld(PurgeTask):
+    """
+    Purge old releases. Newest ``keep_number`` releases are kept as long as
+    they take no more than ``keep_bytes``; more releases are purged while
+    there is less than ``min_free_bytes`` free space. Current release is
+    never purged. Sizes are like ``2G``; with ``dry_run`` releases are only
+    reported.
+    """
+
     @conf
     def keep_number(self):
         return 5
 
+    @conf
+    def keep_bytes(self):
+        return None
+
+    @conf
+    def min_free_bytes(self):
+        return None
+
+    @conf
+    def dry_run(self):
+        return False
+
+    def scan(self, releases):
+        """
+        Return ``({release: bytes}, free bytes, current release)`` found
+        with one remote command. Files that newer releases share (hardlink)
+        are counted in newest of them only.
+        """
+        with settings(hide('running', 'stdout'), warn_only=True):
+            out = run(
+                'cd %s && du --summarize --bytes %s; '
+                'echo "free $(df -P -B 1 %s | awk \'NR == 2 {print $4}\')"; '
+                'echo "current $(readlink %s)"' % (
+                    self.conf.releases_path, ' '.join(releases),
+                    self.conf.home_path, self.conf.current_release_link))
+
+        sizes = dict((name, 0) for name in releases)
+        free, current = None, None
+        for line in split_lines(out):
+            if line.startswith('free '):
+                value = line[5:].strip()
+                free = int(value) if value.isdigit() else None
+            elif line.startswith('current '):
+                current = posixpath.basename(line[8:].strip()) or None
+            else:
+                size, _, name = line.partition('\t')
+                if name in sizes and size.isdigit():
+                    sizes[name] = int(size)
+        return sizes, free, current
+
+    def measures_sizes(self):
+        return (self.conf.keep_bytes is not None or
+                self.conf.min_free_bytes is not None or
+                is_true(self.conf.dry_run))
+
+    def current_release(self):
+        with settings(hide('everything'), warn_only=True):
+            out = run('readlink %s' % self.conf.current_release_link)
+        return posixpath.basename(out.strip()) or None
+
+    def plan(self, releases):
+        """
+        Return ``(releases to purge, {release: bytes}, free bytes)`` for
+        releases ordered from newest to oldest. Sizes are measured only for
+        size and free space policies and dry run; otherwise sizes and free
+        space are None.
+        """
+        keep_number = int(self.conf.keep_number)
+        if not self.measures_sizes():
+            # count only policy does not walk releases
+            if len(releases) <= keep_number:
+                return [], None, None
+            current = self.current_release()
+            old = [name for name in releases[keep_number:] if name != current]
+            return old, None, None
+
+        sizes, free, current = self.scan(releases)
+        keep_bytes = parse_size(self.conf.keep_bytes)
+        min_free_bytes = parse_size(self.conf.min_free_bytes)
+
+        kept, old = [], []
+        kept_bytes = 0
+        for i, name in enumerate(releases):
+            kept_bytes += sizes[name]
+            if name == current or i == 0 or (
+                    i < keep_number and
+                    (keep_bytes is None or kept_bytes <= keep_bytes)):
+                kept.append(name)
+            else:
+                old.append(name)
+
+        if min_free_bytes is not None and free is not None:
+            reclaimed = sum(sizes[name] for name in old)
+            for name in reversed(kept[1:]):
+                if free + reclaimed >= min_free_bytes:
+                    break
+                if name != current:
+                    old.insert(0, name)
+                    reclaimed += sizes[name]
+
+        old.sort(reverse=True)
+        return old, sizes, free
+
     def do(self):
         with list_releases.tmp_conf(self.conf):
             releases = list_releases.releases()
 
-        old_releases = [v for v, is_tmp in releases if not is_tmp]
-        if len(old_releases) <= self.conf.keep_number:
+        releases = [v for v, is_tmp in releases if not is_tmp]
+        if not releases:
+            puts('There are no releases - nothing to purge...')
+            return
+
+        old_releases, sizes, free = self.plan(releases)
+        if not old_releases:
             puts('There are only %s releases available - nothing to purge...' %
-                 len(old_releases))
+                 len(releases))
             return
 
-        old_releases = old_releases[self.conf.keep_number:]
+        if is_true(self.conf.dry_run):
+            reclaimed = sum(sizes[name] for name in old_releases)
+            for name in old_releases:
+                puts('%s - %s' % (name, format_size(sizes[name])))
+            puts('%s would be reclaimed, %s is free' % (
+                format_size(reclaimed),
+                'unknown' if free is None else format_size(free)))
+            return old_releases
+
         if self.purge_confirmed(old_releases):
             self.purge(old_releases)
+            if sizes is not None:
+                puts('%s reclaimed' % format_size(
+                    sum(sizes[name] for name in old_releases)))
 
 purge_old = PurgeOld()
 
 
+class PurgeStatus(Task):
+    """Print how much purged data is waiting to be deleted."""
+
+    def do(self):
+        with settings(hide('running', 'stdout'), warn_only=True):
+            out = run(
+                'cd %(trash_path)s 2>/dev/null || exit 0; '
+                'echo "files $(find . -mindepth 1 | wc --lines)"; '
+                'echo "bytes $(du --summarize --bytes . | cut --fields=1)"; '
+                'flock --nonblock %(trash_path)s.lock true '
+                '|| echo "running 1"' % self.conf)
+
+        status = {'files': 0, 'bytes': 0, 'running': 0}
+        for line in split_lines(out):
+            name, _, value = line.partition(' ')
+            if name in status and value.strip().isdigit():
+                status[name] = int(value)
+        status['running'] = bool(status['running'])
+
+        puts('Pending: %(files)s files, %(bytes)s bytes' % status)
+        if status['running']:
+            puts('Reclaimer is running')
+        elif status['files']:
+            puts('Reclaimer is not running, purge again to restart it')
+        return status
+
+purge_status = PurgeStatus()
+
+
 class Purge(Task):
     def do(self):
         purge_tmp.run()
@@ -0,0 +1,274 @@
+"""
+Running tasks of one host concurrently according to their dependencies.
+
+Task declares tasks it depends on with ``requires``::
+
+    class Migrate(django.Migrate):
+        requires = [django.push_settings, virtualenv.pip_install_req]
+
+Independent tasks are run in separate threads (and separate SSH channels
+of one connection). Output of every task is printed as one block, in
+dependency order, no matter in which order tasks finish.
+"""
+
+import sys
+import heapq
+import Queue
+import logging
+import threading
+
+from fabric import state
+from fabric.api import env, puts, abort
+
+from . import context
+from .base import setup_fabdeploy
+from .context import local_env
+from .task import Task, ExecuteTask
+from .utils import run_fab_task, RunResult, queue_get
+
+
+__all__ = ['execute']
+
+
+logger = logging.getLogger('fabdeploy.scheduler')
+
+
+class CircularTaskException(Exception):
+    pass
+
+
+def task_name(task):
+    if isinstance(task, Task):
+        return '%s.%s' % (task._get_module(), task.name)
+    return getattr(task, 'name', getattr(task, '__name__', repr(task)))
+
+
+def task_graph(tasks):
+    """
+    Return tasks (including required ones) in dependency order and
+    ``{task: set(required tasks)}``. Order of independent tasks is the
+    order in which they are given.
+    """
+    found = []
+    graph = {}
+    stack = list(reversed(tasks))
+    while stack:
+        task = stack.pop()
+        if task in graph:
+            continue
+        requires = list(getattr(task, 'requires', None) or ())
+        graph[task] = set(requires)
+        found.append(task)
+        stack.extend(reversed(requires))
+
+    index = dict((task, i) for i, task in enumerate(found))
+    dependents = dict((task, []) for task in found)
+    counts = {}
+    for task, requires in graph.items():
+        counts[task] = len(requires)
+        for required in requires:
+            dependents[required].append(task)
+
+    ready = [(index[t], t) for t in found if not counts[t]]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        _, task = heapq.heappop(ready)
+        order.append(task)
+        for dependent in dependents[task]:
+            counts[dependent] -= 1
+            if not counts[dependent]:
+                heapq.heappush(ready, (index[dependent], dependent))
+
+    if len(order) != len(found):
+        cycle = [task_name(t) for t in found if counts[t]]
+        raise CircularTaskException(
+            'Circular task requirements: %s' % ', '.join(cycle))
+    return order, graph
+
+
+class CapturedStream(object):
+    """Stream that stores writes in buffer of one task."""
+
+    def __init__(self, buffer, stream):
+        self.buffer = buffer
+        self.stream = stream
+
+    def write(self, data):
+        self.buffer.append((self.stream, data))
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class ThreadOutput(object):
+    """sys.stdout/sys.stderr replacement that captures writes per thread."""
+
+    def __init__(self, stream, index):
+        self.stream = stream
+        # 0 - stdout, 1 - stderr
+        self.index = index
+
+    def write(self, data):
+        streams = context.output_streams()
+        if streams is None:
+            self.stream.write(data)
+        else:
+            streams[self.index].write(data)
+
+    def flush(self):
+        if context.output_streams() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class TaskResult(RunResult):
+    def __init__(self, task):
+        super(TaskResult, self).__init__()
+        self.task = task
+        self.name = task_name(task)
+        self.result = None
+        self.output = []
+        self.done = False
+
+    @property
+    def skipped(self):
+        return not self.done
+
+
+class Scheduler(object):
+    def __init__(self, tasks, concurrency=4, preconnect=True):
+        self.order, self.graph = task_graph(tasks)
+        self.concurrency = max(1, concurrency)
+        self.preconnect = preconnect
+
+    def _connect(self):
+        # connection is opened before threads are started, so they share it
+        host_string = env.get('host_string')
+        if host_string and host_string not in state.connections:
+            state.connections.connect(host_string)
+
+    def _run_task(self, conf, host_string, r, done):
+        out = CapturedStream(r.output, self._stdout)
+        err = CapturedStream(r.output, self._stderr)
+        context.set_output_streams((out, err))
+        def run_task():
+            with local_env(conf=conf, host_string=host_string):
+                return run_fab_task(r.task)
+
+        try:
+            r.result = r.call(run_task)
+        finally:
+            context.set_output_streams(None)
+            r.done = True
+            done.put(r)
+
+    def _print(self, r):
+        for stream, data in r.output:
+            stream.write(data)
+        r.output[:] = []
+
+    def execute(self):
+        if not hasattr(env, 'conf'):
+            setup_fabdeploy()
+        if self.preconnect and self.concurrency > 1:
+            self._connect()
+
+        conf, host_string = env.conf, env.get('host_string')
+        results = dict((task, TaskResult(task)) for task in self.order)
+        index = dict((task, i) for i, task in enumerate(self.order))
+        requires = dict((t, set(r)) for t, r in self.graph.items())
+        ready = [(index[t], t) for t in self.order if not requires[t]]
+        heapq.heapify(ready)
+
+        done = Queue.Queue()
+        running = 0
+        printed = 0
+        failed = False
+
+        self._stdout, self._stderr = sys.stdout, sys.stderr
+        sys.stdout = ThreadOutput(self._stdout, 0)
+        sys.stderr = ThreadOutput(self._stderr, 1)
+        try:
+            while ready or running:
+                while ready and running < self.concurrency and not failed:
+                    _, task = heapq.heappop(ready)
+                    t = threading.Thread(
+                        target=self._run_task,
+                        args=(conf, host_string, results[task], done))
+                    t.daemon = True
+                    t.start()
+                    running += 1
+                if not running:
+                    break
+
+                r = queue_get(done)
+                running -= 1
+
+                if r.failed:
+                    failed = True
+                else:
+                    for task in self.order:
+                        if r.task in requires[task]:
+                            requires[task].discard(r.task)
+                            if not requires[task]:
+                                heapq.heappush(ready, (index[task], task))
+
+                # output is printed in dependency order
+                while printed < len(self.order) and \
+                        results[self.order[printed]].done:
+                    self._print(results[self.order[printed]])
+                    printed += 1
+        finally:
+            sys.stdout, sys.stderr = self._stdout, self._stderr
+
+        ordered = [results[task] for task in self.order]
+        for r in ordered:
+            self._print(r)
+        return ordered
+
+
+def run_graph(tasks, concurrency=None, preconnect=True):
+    """
+    Run tasks and tasks they require on current host, at most
+    ``concurrency`` at a time. Exception of first failed task is raised
+    after running tasks are finished; tasks that were not started yet are
+    skipped. Returns list of :class:`TaskResult` in dependency order.
+    """
+    if not hasattr(env, 'conf'):
+        setup_fabdeploy()
+    if concurrency is None:
+        concurrency = env.conf.task_concurrency
+    scheduler = Scheduler(tasks, concurrency=int(concurrency),
+                          preconnect=preconnect)
+    results = scheduler.execute()
+    for r in results:
+        if r.failed:
+            logger.debug('run_graph: %s failed' % r.name)
+            raise r.exc_info[0], r.exc_info[1], r.exc_info[2]
+    return results
+
+
+class Execute(ExecuteTask):
+    """
+    Run fab tasks and tasks they require, independent ones concurrently,
+    e.g. ``fab fabd.conf:prod scheduler.execute:"nginx.reload;pip.install"``.
+    """
+
+    def do(self):
+        tasks = self.fab_tasks()
+        try:
+            results = run_graph(
+                tasks, concurrency=self.conf.task_concurrency)
+        except CircularTaskException, exc:
+            abort(str(exc))
+        for r in results:
+            puts('%s: done' % r.name)
+        return results
+
+execute = Execute()
@@ -8,7 +8,7 @@ from fabric.contrib import files
 from .containers import conf, MissingVarException
 from .task import Task
 from .users import list_users
-from .files import read_file, exists
+from .files import read_file, exists_many
 from .utils import home_path, split_lines
 
 
@@ -55,13 +55,11 @@ class ListAuthorizedFiles(SshManagementTask):
     def get_authorized_files(self, exclude_users=None):
         users = list_users.get_users(exclude_users=exclude_users)
 
-        authorized_files = []
-        for user in users:
-            dirpath = home_path(user)
-            authorized_file = '%s/.ssh/authorized_keys' % dirpath
-            if exists(authorized_file, use_sudo=True, shell=False):
-                authorized_files.append((user, authorized_file))
-        return authorized_files
+        candidates = [(user, '%s/.ssh/authorized_keys' % home_path(user))
+                      for user in users]
+        exists = exists_many([f for _, f in candidates],
+                             use_sudo=True, shell=False)
+        return [(user, f) for user, f in candidates if exists[f]]
 
     def do(self):
         authorized_files = self.get_authorized_files(
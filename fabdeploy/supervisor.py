@@ -115,6 +115,10 @@ reload = Reload()
 
 
 class PushDConfig(Task):
+    skip_unchanged = True
+    inputs = ['supervisord_config_file']
+    input_templates = ['supervisord_config_lfile']
+
     def do(self):
         upload_config_template(
             self.conf.supervisord_config_lfile,
@@ -6,13 +6,16 @@ from fabric.utils import puts, abort
 from fabric.contrib.files import append
 
 from .containers import conf
+from .facts import get_cache
 from .task import Task
 
 
 __all__ = [
     'exe_python',
+    'facts',
     'cpu_count',
     'os_codename',
+    'mem_total',
     'package_update',
     'package_install',
     'setup_backports',
@@ -36,13 +39,157 @@ class ExePython(Task):
 exe_python = ExePython()
 
 
-class CpuCount(ExePython):
+# Script that gathers all facts with one remote command. It is passed to
+# ``python -c "..."``, so it must not contain double quotes, ``$`` or
+# backticks.
+FACTS_CODE = """
+import os, platform, multiprocessing, subprocess
+facts = {}
+facts['cpu_count'] = multiprocessing.cpu_count()
+
+meminfo = {}
+for line in open('/proc/meminfo'):
+    name, value = line.split(':', 1)
+    meminfo[name] = int(value.split()[0]) // 1024
+facts['mem_total'] = meminfo['MemTotal']
+facts['mem_available'] = meminfo.get(
+    'MemAvailable',
+    meminfo['MemFree'] + meminfo.get('Buffers', 0) + meminfo.get('Cached', 0))
+
+try:
+    facts['dist'] = tuple(platform.dist())
+except AttributeError:
+    facts['dist'] = ('', '', '')
+release = {}
+if os.path.exists('/etc/os-release'):
+    for line in open('/etc/os-release'):
+        if '=' in line:
+            name, value = line.strip().split('=', 1)
+            release[name] = value.strip(chr(34))
+facts['dist_codename'] = release.get('VERSION_CODENAME', '')
+facts['python_version'] = platform.python_version()
+
+try:
+    st = os.statvfs(%(home_path)r)
+    facts['disk_free'] = st.f_bavail * st.f_frsize // 1024 // 1024
+except OSError:
+    facts['disk_free'] = None
+
+if os.path.isdir('/run/systemd/system'):
+    facts['init_system'] = 'systemd'
+elif os.path.exists('/sbin/initctl'):
+    facts['init_system'] = 'upstart'
+else:
+    facts['init_system'] = 'sysvinit'
+
+facts['packages'] = {}
+fields = [chr(36) + '{Package}', chr(36) + '{Version}', chr(36) + '{Status}']
+try:
+    p = subprocess.Popen(
+        ['dpkg-query', '--show', '--showformat',
+         chr(9).join(fields) + chr(10)] + %(packages)r,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out = p.communicate()[0].decode()
+except OSError:
+    # not a Debian based host
+    out = ''
+for line in out.splitlines():
+    package, version, status = line.split(chr(9))
+    if status.endswith(' installed'):
+        facts['packages'][package] = version
+
+print(repr(facts))
+"""
+
+
+OS_PATTERNS = [
+    ('squeeze', ('debian', '^6', '')),
+    ('lenny', ('debian', '^5', '')),
+    ('precise', ('Ubuntu', '^12.04', '')),
+    ('oneiric', ('Ubuntu', '^11.10', '')),
+    ('natty', ('Ubuntu', '^11.04', '')),
+    ('maverick', ('Ubuntu', '^10.10', '')),
+    ('lucid', ('Ubuntu', '^10.04', '')),
+]
+
+
+def os_codename_from_dist(distname, version, id):
+    for name, p in OS_PATTERNS:
+        if (re.match(p[0], distname) and
+                re.match(p[1], version) and
+                re.match(p[2], id)):
+            return name
+
+
+class Facts(ExePython):
+    """
+    Gather facts about remote host with one remote command.
+
+    Facts are cached locally, see :mod:`fabdeploy.facts`.
+    """
+
+    NAMES = [
+        'cpu_count',
+        'mem_total',
+        'mem_available',
+        'os',
+        'python_version',
+        'disk_free',
+        'init_system',
+        'installed_packages',
+    ]
+
     @conf
     def code(self):
-        return 'import multiprocessing; print(multiprocessing.cpu_count())'
+        return FACTS_CODE % {
+            'home_path': self.conf.home_path,
+            'packages': list(self.conf.facts_packages),
+        }
+
+    def gather(self):
+        r = self.exe()
+        r['os'] = os_codename_from_dist(*r['dist']) or \
+            r['dist_codename'] or None
+        r['installed_packages'] = r['packages']
+        return dict([(name, r[name]) for name in self.NAMES])
+
+    def refresh(self):
+        facts = self.gather()
+        get_cache(self.conf).update(facts)
+        return facts
+
+    def facts(self):
+        cache = get_cache(self.conf)
+        try:
+            return cache.get_many(self.NAMES)
+        except KeyError:
+            return self.refresh()
+
+    def get(self, name):
+        return self.facts()[name]
+
+    def do(self):
+        for name, value in sorted(self.facts().items()):
+            puts('%s = %r' % (name, value))
+
+facts = Facts()
+
+
+class FactTask(Task):
+    """Task that shows one of host facts."""
+
+    fact_name = None
+
+    def fact(self):
+        with facts.tmp_conf(self.conf):
+            return facts.get(self.fact_name)
+
+
+class CpuCount(FactTask):
+    fact_name = 'cpu_count'
 
     def cpu_count(self):
-        return self.exe()
+        return self.fact()
 
     def do(self):
         cpu_count = self.cpu_count()
@@ -51,28 +198,11 @@ class CpuCount(ExePython):
 cpu_count = CpuCount()
 
 
-class OSCodename(ExePython):
-    @conf
-    def code(self):
-        return 'import platform; print(platform.dist())'
+class OSCodename(FactTask):
+    fact_name = 'os'
 
     def os_codename(self):
-        distname, version, id = self.exe()
-
-        patterns = [
-            ('squeeze', ('debian', '^6', '')),
-            ('lenny', ('debian', '^5', '')),
-            ('precise', ('Ubuntu', '^12.04', '')),
-            ('oneiric', ('Ubuntu', '^11.10', '')),
-            ('natty', ('Ubuntu', '^11.04', '')),
-            ('maverick', ('Ubuntu', '^10.10', '')),
-            ('lucid', ('Ubuntu', '^10.04', '')),
-        ]
-        for name, p in patterns:
-            if (re.match(p[0], distname) and
-                    re.match(p[1], version) and
-                    re.match(p[2], id)):
-                return name
+        return self.fact()
 
     def do(self):
         os_codename = self.os_codename()
@@ -84,6 +214,20 @@ class OSCodename(ExePython):
 os_codename = OSCodename()
 
 
+class MemTotal(FactTask):
+    """Total memory in megabytes."""
+
+    fact_name = 'mem_total'
+
+    def mem_total(self):
+        return self.fact()
+
+    def do(self):
+        puts('Total memory: %s MB' % self.mem_total())
+
+mem_total = MemTotal()
+
+
 class PackageUpdate(Task):
     @conf
     def force(self):
@@ -102,6 +246,8 @@ class PackageInstall(Task):
 
     def do(self):
         sudo('apt-get install %(options)s -y %(packages)s' % self.conf)
+        # installed_packages fact is stale now
+        get_cache(self.conf).delete('installed_packages')
 
 package_install = PackageInstall()
 
@@ -125,6 +271,9 @@ BACKPORTS = {
 
 
 class SetupBackports(Task):
+    skip_unchanged = True
+    inputs = ['backports']
+
     @conf
     def backports(self):
         if self.conf.os in BACKPORTS:
@@ -1,15 +1,108 @@
 import os
+import socket
+import threading
+import subprocess
 
-from fabric.api import local, run, put, lcd, cd
+from fabric.api import env, local, run, put, lcd, cd, puts
+from fabric.network import needs_host
+from fabric.state import connections, output
+from fabric.utils import error
 
+from . import context, counters, trace
 from .containers import conf
 from .task import Task
+from .utils import is_true
 
 
 __all__ = ['push', 'push_files']
 
 
+# size of chunks that are read from local command and sent to channel
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _open_channel():
+    transport = connections[env.host_string].get_transport()
+    return transport.open_session()
+
+
+def _read_channel(channel, buffer):
+    while True:
+        data = channel.recv(STREAM_CHUNK_SIZE)
+        if not data:
+            break
+        buffer.append(data)
+
+
+@needs_host
+def stream_command(local_command, remote_command):
+    """
+    Run ``local_command`` and pipe its output to ``remote_command`` through
+    one SSH channel, so both commands and transfer run at the same time.
+    Return number of bytes that were sent.
+    """
+    batch = context.current_batch()
+    if batch is not None:
+        batch.flush()
+    if output.running:
+        puts('stream: %s | %s' % (local_command, remote_command))
+
+    with trace.span('stream %s' % remote_command[:80], 'stream',
+                    host=env.host_string, local_command=local_command,
+                    remote_command=remote_command) as args:
+        channel = _open_channel()
+        channel.set_combine_stderr(True)
+        channel.exec_command(remote_command)
+        # remote output is read in thread, so remote command never blocks
+        remote_output = []
+        reader = threading.Thread(
+            target=_read_channel, args=(channel, remote_output))
+        reader.daemon = True
+        reader.start()
+
+        process = subprocess.Popen(local_command, shell=True,
+                                   stdout=subprocess.PIPE,
+                                   cwd=env.lcwd or None)
+        sent = 0
+        try:
+            while True:
+                data = process.stdout.read(STREAM_CHUNK_SIZE)
+                if not data:
+                    break
+                try:
+                    channel.sendall(data)
+                except socket.error:
+                    # remote command exited, its status is reported below
+                    break
+                sent += len(data)
+        finally:
+            process.stdout.close()
+            local_status = process.wait()
+            channel.shutdown_write()
+        remote_status = channel.recv_exit_status()
+        reader.join()
+        channel.close()
+
+        if args is not None:
+            args['bytes'] = sent
+            args['return_code'] = remote_status
+        counters.add(commands=1, uploads=1, bytes=sent)
+
+    # local command is killed by SIGPIPE when remote one fails
+    if remote_status != 0:
+        error('Remote command %r failed with status %s:\n%s' % (
+            remote_command, remote_status, ''.join(remote_output)))
+    elif local_status != 0:
+        error('Local command %r failed with status %s' % (
+            local_command, local_status))
+    return sent
+
+
 class PushTask(Task):
+    @conf
+    def stream(self):
+        return True
+
     @conf
     def src_file(self):
         if 'src_file' not in self.conf:
@@ -24,6 +117,27 @@ class PushTask(Task):
                 '%(target_path)s/fabdeploy_%(current_time)s.tar' % self.conf
         return self.conf.target_file
 
+    def push(self, tar_options):
+        """Pack files selected by ``tar_options`` and unpack them remotely."""
+        if is_true(self.conf.stream):
+            return stream_command(
+                'tar --create --gzip --file - %s' % tar_options,
+                'cd %s && tar --extract --gunzip --file -' %
+                self.conf.target_path)
+
+        local('tar '
+              '--create '
+              '--gzip '
+              '--file %s %s' % (self.conf.src_file, tar_options))
+        put(self.conf.src_file, self.conf.target_file)
+        local('rm %(src_file)s' % self.conf)
+        with cd(self.conf.target_path), self.batch():
+            run('tar '
+                '--extract '
+                '--gunzip '
+                '--file %(target_file)s' % self.conf)
+            run('rm %(target_file)s' % self.conf)
+
 
 class Push(PushTask):
     @conf
@@ -38,19 +152,8 @@ class Push(PushTask):
         return exclude_string
 
     def do(self):
-        local('tar %(exclude_string)s '
-              '--create '
-              '--gzip '
-              '--file %(src_file)s '
-              '--directory %(release_path)s .' % self.conf)
-        put(self.conf.src_file, self.conf.target_file)
-        local('rm %(src_file)s' % self.conf)
-        with cd(self.conf.target_path):
-            run('tar '
-                '--extract '
-                '--gunzip '
-                '--file %(target_file)s' % self.conf)
-            run('rm %(target_file)s' % self.conf)
+        self.push('%(exclude_string)s --directory %(release_path)s .' %
+                  self.conf)
 
 push = Push()
 
@@ -61,22 +164,9 @@ class PushFiles(PushTask):
             files = self.conf.files
         else:
             files = [f.strip() for f in self.conf.files.split(',')]
-        self.conf._files = '--add-file ' + '--add-file '.join(files)
+        self.conf._files = ' '.join(['--add-file %s' % f for f in files])
 
         with lcd(self.conf.release_path):
-            local(
-                'tar '
-                '--create '
-                '--gzip '
-                '--file %(src_file)s '
-                '%(_files)s' % self.conf)
-        put(self.conf.src_file, self.conf.target_file)
-        local('rm %(src_file)s' % self.conf)
-        with cd(self.conf.target_path):
-            run('tar '
-                '--extract '
-                '--gunzip '
-                '--file %(target_file)s' % self.conf)
-            run('rm %(target_file)s' % self.conf)
+            self.push(self.conf._files)
 
 push_files = PushFiles()
@@ -3,18 +3,31 @@ import inspect
 import warnings
 from contextlib import contextmanager
 
-from fabric.api import env, settings
+from fabric.api import env, settings, puts
 from fabric.tasks import Task as BaseTask
 
+from . import context, counters, digests, trace
+from .batch import batched
 from .base import setup_fabdeploy
 from .containers import BaseConf, MissingVarException
-from .utils import unprefix_conf
+from .utils import get_fab_tasks
+
+
+_first_cap_re = re.compile('(.)([A-Z][a-z]+)')
+_all_cap_re = re.compile('([a-z0-9])([A-Z])')
 
 
 class Task(BaseTask):
     name = None
-    task_kwargs = {}
-    _curr_conf_names = set()
+    # expected number of remote calls per run, e.g. {'commands': 2},
+    # see fabdeploy.counters
+    budget = None
+    # skip task when inputs did not change, see fabdeploy.digests
+    skip_unchanged = False
+    inputs = ()
+    input_templates = ()
+    # tasks that must finish before this one, see fabdeploy.scheduler
+    requires = ()
 
     def __init__(self, *args, **kwargs):
         super(Task, self).__init__(*args, **kwargs)
@@ -22,6 +35,24 @@ class Task(BaseTask):
             self.name = self._generate_name()
         self._reset_conf()
 
+    # conf and task_kwargs are stored per thread, because task instances
+    # are shared
+    def _get_conf(self):
+        return context.task_state(self)[0]
+
+    def _set_conf(self, conf):
+        context.set_task_state(self, conf, self.task_kwargs)
+
+    conf = property(_get_conf, _set_conf)
+
+    def _get_task_kwargs(self):
+        return context.task_state(self)[1]
+
+    def _set_task_kwargs(self, task_kwargs):
+        context.set_task_state(self, self.conf, task_kwargs)
+
+    task_kwargs = property(_get_task_kwargs, _set_task_kwargs)
+
     def before_do(self):
         pass
 
@@ -31,39 +62,59 @@ class Task(BaseTask):
     def do(self):
         raise NotImplementedError()
 
+    @classmethod
+    def _class_conf_keys(cls):
+        # cached per class, because inspect.getmembers is slow
+        try:
+            return cls.__dict__['_cached_conf_keys']
+        except KeyError:
+            keys = frozenset([name for name, value in inspect.getmembers(cls)
+                              if hasattr(value, '_is_conf')])
+            cls._cached_conf_keys = keys
+            return keys
+
     def conf_keys(self):
-        keys = set()
+        keys = set(self._class_conf_keys())
         keys.update(self.task_kwargs.keys())
-        for name, value in inspect.getmembers(self):
-            if hasattr(value, '_is_conf'):
-                keys.add(name)
         return keys
 
     def conf_value(self, name, null=object()):
-        if name in self._curr_conf_names:
+        conf_names = context.conf_names()
+        if name in conf_names:
             raise MissingVarException
-        self._curr_conf_names.add(name)
+        conf_names.add(name)
         value = null
 
-        if name in self.task_kwargs:
-            value = self.task_kwargs[name]
-        else:
-            try:
-                attr = getattr(self, name)
-                if hasattr(attr, '_is_conf'):
-                    value = attr()
-            except AttributeError:
-                pass
-
-        self._curr_conf_names.remove(name)
+        try:
+            if name in self.task_kwargs:
+                value = self.task_kwargs[name]
+            else:
+                try:
+                    attr = getattr(self, name)
+                    if hasattr(attr, '_is_conf'):
+                        value = attr()
+                except AttributeError:
+                    pass
+        finally:
+            conf_names.remove(name)
         if value is not null:
             return value
         else:
             raise MissingVarException
 
+    @classmethod
+    def _class_name(cls):
+        # cached per class, like _class_conf_keys
+        try:
+            return cls.__dict__['_cached_name']
+        except KeyError:
+            s1 = _first_cap_re.sub(r'\1_\2', cls.__name__)
+            name = _all_cap_re.sub(r'\1_\2', s1).lower()
+            cls._cached_name = name
+            return name
+
     def _generate_name(self):
-        s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', self.__class__.__name__)
-        return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
+        return self._class_name()
 
     def _reset_conf(self):
         self.conf = None
@@ -114,7 +165,7 @@ class Task(BaseTask):
                 self.task_kwargs = task_kwargs
 
             self.conf.set_name('%s.%s' % (self._get_module(), self.name))
-            unprefix_conf(self.conf, self._namespaces(self.task_kwargs))
+            self.conf.unprefix(self._namespaces(self.task_kwargs))
 
             with settings(
                 host_string=self.conf.get('address', ''), **fabric_settings):
@@ -122,9 +173,42 @@ class Task(BaseTask):
         finally:
             self._reset_conf()
 
+    def batch(self):
+        """
+        Context manager. ``run`` and ``sudo`` calls inside it are executed
+        as one remote script, see :func:`fabdeploy.batch.batched`.
+        """
+        return batched()
+
     def run(self, **kwargs):
+        name = '%s.%s' % (self._get_module(), self.name)
         with self.tmp_conf(task_kwargs=kwargs):
-            self.before_do()
-            result = self.do()
-            self.after_do(result)
+            with trace.span(name, 'task', host=env.host_string):
+                with counters.task(name, self.budget):
+                    self.before_do()
+                    if self.skip_unchanged:
+                        return self._run_unchanged(name)
+                    result = self.do()
+                    self.after_do(result)
         return result
+
+    def _run_unchanged(self, name):
+        is_unchanged, digest = digests.unchanged(self)
+        if is_unchanged:
+            puts('%s is skipped, because its inputs did not change.' % name)
+            return None
+        result = self.do()
+        self.after_do(result)
+        digests.save(self, digest)
+        return result
+
+
+class ExecuteTask(Task):
+    """Task that runs fab tasks given in ``tasks``, separated with ``;``."""
+
+    def fab_tasks(self):
+        return get_fab_tasks(self.conf.tasks)
+
+    def run(self, tasks, **kwargs):
+        kwargs.setdefault('tasks', tasks)
+        return super(ExecuteTask, self).run(**kwargs)
@@ -0,0 +1,115 @@
+"""
+Timing of tasks, remote commands and uploads.
+
+Spans are recorded only inside :func:`tracing` and are saved in Chrome
+trace format, which can be opened in chrome://tracing or Perfetto.
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from .context import null_context
+
+
+__all__ = ['tracing', 'span']
+
+
+class Tracer(object):
+    def __init__(self):
+        self.pid = os.getpid()
+        # events are appended from several threads, list.append is atomic
+        self.events = []
+        self._threads = {}
+
+    def _thread_id(self):
+        thread = threading.current_thread()
+        tid = thread.ident
+        if tid not in self._threads:
+            self._threads[tid] = thread.name
+        return tid
+
+    @contextmanager
+    def span(self, name, cat, **args):
+        tid = self._thread_id()
+        # microseconds; end is rounded the same way, so spans nest exactly
+        started = int(time.time() * 1e6)
+        try:
+            yield args
+        except BaseException, exc:
+            args['error'] = repr(exc)
+            raise
+        finally:
+            self.events.append({
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': started,
+                'dur': int(time.time() * 1e6) - started,
+                'pid': self.pid,
+                'tid': tid,
+                'args': args,
+            })
+
+    def trace_events(self):
+        events = []
+        for tid, name in sorted(self._threads.items()):
+            events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': self.pid,
+                'tid': tid,
+                'args': {'name': name},
+            })
+        events.extend(sorted(self.events, key=lambda e: e['ts']))
+        return events
+
+    def dump(self, path):
+        with open(path, 'wt') as f:
+            json.dump({
+                'traceEvents': self.trace_events(),
+                'displayTimeUnit': 'ms',
+            }, f)
+
+
+# current Tracer; None when tracing is disabled
+_tracer = None
+
+
+def span(name, cat, **args):
+    """
+    Context manager. Records span when tracing is enabled. It returns
+    dict of span args (or None), so values known at the end can be added::
+
+        with trace.span(command, 'run', host=env.host_string) as args:
+            out = run(command)
+            if args is not None:
+                args['return_code'] = out.return_code
+
+    """
+    tracer = _tracer
+    if tracer is None:
+        return null_context
+    return tracer.span(name, cat, **args)
+
+
+@contextmanager
+def tracing(path=None):
+    """
+    Context manager. Records spans and saves them to ``path`` on exit::
+
+        with tracing('deploy.json'):
+            deploy()
+
+    """
+    global _tracer
+    previous = _tracer
+    _tracer = tracer = Tracer()
+    try:
+        yield tracer
+    finally:
+        _tracer = previous
+        if path:
+            tracer.dump(path)
@@ -4,7 +4,8 @@ from fabric.api import settings, sudo, puts
 from fabric.contrib import files
 
 from .task import Task
-from .files import list_files
+from .files import list_files, read_file
+from .utils import split_lines
 
 
 __all__ = ['create', 'delete', 'grant_sudo', 'list_users']
@@ -36,6 +37,8 @@ grant_sudo = GrantSudo()
 
 
 class ListUsers(Task):
+    budget = {'commands': 2}
+
     def before_do(self):
         self.conf.setdefault('exclude_users', [])
 
@@ -43,13 +46,16 @@ class ListUsers(Task):
         if exclude_users is None:
             exclude_users = []
 
+        # /etc/passwd is read once instead of grepping it for every user
+        passwd_users = set([line.split(':', 1)[0]
+                            for line in split_lines(read_file('/etc/passwd'))])
+
         users = []
         if 'root' not in exclude_users:
             users.append('root')
         for dirpath in list_files('/home'):
             user = os.path.basename(dirpath)
-            if user not in exclude_users and \
-               files.contains('/etc/passwd', user):
+            if user not in exclude_users and user in passwd_users:
                 users.append(user)
         return users
 
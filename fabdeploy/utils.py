@@ -1,9 +1,13 @@
+import sys
+import time
+import Queue
 import posixpath
 from functools import wraps
 from contextlib import contextmanager
 
 from fabric.api import env, sudo, cd, prefix, abort
-from fabric import network
+from fabric import network, state
+from fabric.task_utils import crawl
 from fabric.contrib.files import upload_template
 
 
@@ -138,8 +142,11 @@ def upload_init_template(name, **kwargs):
     sudo('chown --recursive root:root ' + to)
 
 
-# TODO: move to conf
 def unprefix_conf(conf, namespaces):
+    if hasattr(conf, 'unprefix'):
+        conf.unprefix(namespaces)
+        return
+
     for ns in namespaces:
         for key in conf.keys():
             if key.startswith(ns):
@@ -155,9 +162,15 @@ def home_path(user):
 
 
 def split_lines(value):
-    lines = value.split('\n')
-    for line in lines:
-        yield line.rstrip('\r')
+    # lines are found one by one, so long output is not copied into list
+    start = 0
+    while True:
+        end = value.find('\n', start)
+        if end == -1:
+            yield value[start:].rstrip('\r')
+            return
+        yield value[start:end].rstrip('\r')
+        start = end + 1
 
 
 class cached_property(object):
@@ -170,3 +183,91 @@ class cached_property(object):
 
         obj.__dict__[self.func.__name__] = value = self.func(obj)
         return value
+
+
+def get_fab_task(name):
+    """Return task by name as it is given to fab, e.g. ``release.activate``."""
+    task = crawl(name.strip(), state.commands)
+    if task is None:
+        abort('Task "%s" is not found.' % name)
+    return task
+
+
+def run_fab_task(task):
+    # fabdeploy and Fabric tasks have run(), @task functions don't
+    if hasattr(task, 'run'):
+        return task.run()
+    return task()
+
+
+def get_fab_tasks(names):
+    """Return tasks by names separated with ``;``, e.g. ``deploy;restart``."""
+    if isinstance(names, basestring):
+        names = names.split(';')
+    return [get_fab_task(name) for name in names]
+
+
+class RunResult(object):
+    """Result of running tasks in thread (see multihost and scheduler)."""
+
+    def __init__(self):
+        self.exception = None
+        self.exc_info = None
+        self.started = None
+        self.duration = None
+
+    @property
+    def failed(self):
+        return self.exception is not None
+
+    def call(self, func, *args, **kwargs):
+        """Call ``func`` and return its result; exception is stored."""
+        self.started = time.time()
+        try:
+            return func(*args, **kwargs)
+        except (Exception, SystemExit), exc:
+            # abort() raises SystemExit
+            self.exception = exc
+            self.exc_info = sys.exc_info()
+        finally:
+            self.duration = time.time() - self.started
+
+
+# threads are waited with timeout, so KeyboardInterrupt is delivered
+
+def queue_get(queue):
+    while True:
+        try:
+            return queue.get(timeout=0.1)
+        except Queue.Empty:
+            continue
+
+
+def join_thread(thread):
+    while thread.is_alive():
+        thread.join(0.1)
+
+
+_size_units = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3,
+               'T': 1024 ** 4}
+
+
+def parse_size(value):
+    """Parse size like ``2G`` or ``512M`` into bytes. None is kept."""
+    if value is None or isinstance(value, (int, long)):
+        return value
+    value = value.strip().upper().rstrip('B')
+    unit = value[-1:] if value[-1:] in _size_units else ''
+    return int(float(value[:len(value) - len(unit)]) * _size_units[unit])
+
+
+def format_size(value):
+    for unit in ['T', 'G', 'M', 'K']:
+        if abs(value) >= _size_units[unit]:
+            return '%.1f%sB' % (float(value) / _size_units[unit], unit)
+    return '%sB' % value
+
+
+def is_true(value):
+    """Return False for false values and their string forms, e.g. ``no``."""
+    return value not in (False, None, '', '0', 'false', 'False', 'no')
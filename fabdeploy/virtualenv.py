@@ -70,8 +70,11 @@ make_relocatable = MakeRelocatable()
 
 class Remove(Task):
     def do(self):
-        for dirname in ['bin', 'include', 'lib', 'src', 'build']:
-            self.conf.dirname = dirname
-            sudo('rm --recursive --force %(env_path)s/%(dirname)s' % self.conf)
+        # commands are executed with one remote call
+        with self.batch():
+            for dirname in ['bin', 'include', 'lib', 'src', 'build']:
+                self.conf.dirname = dirname
+                sudo('rm --recursive --force %(env_path)s/%(dirname)s' %
+                     self.conf)
 
 remove = Remove()
@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import subprocess
+
+
+IMPORT_CODE = '''
+import sys, json, time
+import fabric.api
+started = time.time()
+from fabdeploy.api import DefaultConf
+conf_time = time.time() - started
+lazy = 'fabdeploy.system' not in sys.modules
+from fabdeploy.api import *
+all_time = time.time() - started
+json.dump({
+    'conf_time': conf_time,
+    'all_time': all_time,
+    'lazy': lazy,
+    'system': 'fabdeploy.system' in sys.modules,
+}, sys.stdout)
+'''
+
+
+def import_stats():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    out = subprocess.Popen(
+        [sys.executable, '-c', IMPORT_CODE],
+        stdout=subprocess.PIPE, env=env).communicate()[0]
+    return json.loads(out)
+
+
+def test_api_imports_modules_lazily():
+    from fabdeploy import api
+    assert 'supervisor' in dir(api)
+    assert api.supervisor.__name__ == 'fabdeploy.supervisor'
+    assert api.Task.__module__ == 'fabdeploy.task'
+
+
+def test_api_does_not_shadow_fabric_api():
+    from fabric import api as fabric_api
+    from fabdeploy import api
+    assert not set(api.__all__) & set(dir(fabric_api))
+
+
+def test_import_time():
+    stats = import_stats()
+    sys.stderr.write(
+        '\nfabdeploy.api import: DefaultConf %.1f ms, all %.1f ms\n' % (
+            stats['conf_time'] * 1000, stats['all_time'] * 1000))
+    assert stats['lazy']
+    assert stats['system']
+    # generous limit, so only big regressions fail
+    assert stats['all_time'] < 2
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import subprocess
+
+from fabric.api import env, cd, settings, hide, shell_env
+from fabric.operations import _AttributeString
+
+from fabdeploy import virtualenv
+from fabdeploy.batch import batched
+from fabdeploy.containers import DefaultConf
+
+from .transport import LocalTransport
+
+
+def local_run_command(command, shell=True, pty=True, combine_stderr=True,
+                      sudo=False, user=None):
+    p = subprocess.Popen(['bash', '-c', command],
+                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = _AttributeString(p.communicate()[0].strip())
+    out.return_code = p.returncode
+    out.failed = p.returncode != 0
+    out.succeeded = not out.failed
+    return out
+
+
+def test_batched():
+    calls = []
+
+    def run_command(command, **kwargs):
+        calls.append(command)
+        return local_run_command(command, **kwargs)
+
+    with settings(hide('everything'), host_string='user@localhost'):
+        with batched(run_command=run_command) as batch:
+            batch.add('echo one; echo two')
+            with cd('/tmp'):
+                batch.add('pwd')
+            with shell_env(FOO='bar'):
+                batch.add('echo $FOO')
+            batch.add('pwd')
+
+    assert len(calls) == 1
+    assert [cmd.return_code for cmd in batch.commands] == [0, 0, 0, 0]
+    outputs = [cmd.output for cmd in batch.commands]
+    assert outputs[:3] == ['one\ntwo', '/tmp', 'bar']
+    assert outputs[3] != '/tmp'
+
+
+def test_batched_stops_on_error():
+    with settings(hide('everything'), host_string='user@localhost',
+                  warn_only=True):
+        with batched(run_command=local_run_command) as batch:
+            batch.add('echo one')
+            batch.add('echo fail; exit 3')
+            batch.add('echo never')
+
+    one, fail, never = batch.commands
+    assert one.succeeded
+    assert fail.return_code == 3
+    assert fail.output == 'fail'
+    assert not never.executed
+
+
+def test_batch_is_flushed_when_options_change():
+    calls = []
+
+    def run_command(command, **kwargs):
+        calls.append(kwargs['sudo'])
+        return local_run_command(command, **kwargs)
+
+    with settings(hide('everything'), host_string='user@localhost'):
+        with batched(run_command=run_command) as batch:
+            batch.add('true')
+            batch.add('true', sudo=True)
+            batch.add('true', sudo=True)
+    assert calls == [False, True]
+
+
+def test_virtualenv_remove_is_batched():
+    env.conf = DefaultConf(name='test_batch')
+    env.conf.address = 'deploy@localhost'
+    env.conf.home_path = tempfile.mkdtemp()
+    env.conf.release = '2012.01.01-00.00.00'
+    for dirname in ['bin', 'lib', 'src']:
+        os.makedirs(os.path.join(env.conf.env_path, dirname))
+
+    transport = LocalTransport()
+    try:
+        with transport.install():
+            virtualenv.remove.run()
+        left = os.listdir(env.conf.env_path)
+    finally:
+        shutil.rmtree(env.conf.home_path)
+
+    assert left == []
+    assert len(transport.commands) == 1
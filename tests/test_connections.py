@@ -0,0 +1,51 @@
+import time
+import threading
+
+from fabric import network
+
+from fabdeploy.connections import ConnectionPool
+
+from .transport import FakeClient
+
+
+def fake_connect(user, host, port, cache, seek_gateway=True):
+    time.sleep(0.05)
+    return FakeClient()
+
+
+def test_pool():
+    old_connect = network.connect
+    network.connect = fake_connect
+    try:
+        pool = ConnectionPool()
+        clients = []
+
+        def worker():
+            clients.append(pool['deploy@example.com'])
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # one connection is made and shared
+        assert len(set(clients)) == 1
+        assert pool['deploy@example.com:22'] is clients[0]
+        root = pool['root@example.com']
+        assert root is not clients[0]
+
+        # dropped connection is replaced
+        clients[0].transport.active = False
+        assert pool['deploy@example.com'] is not clients[0]
+
+        stats = pool.stats()
+        assert stats['deploy@example.com:22'] == {
+            'connects': 2, 'reuses': 8, 'reconnects': 1, 'active': True}
+        assert stats['root@example.com:22']['connects'] == 1
+
+        pool.close()
+        assert not pool
+        assert not pool.stats()['root@example.com:22']['active']
+    finally:
+        network.connect = old_connect
@@ -1,7 +1,12 @@
+import time
+
 from jinja2 import Template
 
+from nose.tools import assert_raises
+
 from fabdeploy.task import Task
-from fabdeploy.containers import BaseConf, conf
+from fabdeploy.containers import BaseConf, conf, compile_template, \
+    CircularVarException, profile_conf
 
 
 def test_set_get():
@@ -60,3 +65,131 @@ def test_jinja2_usage():
     template = Template('{{ foo }}')
     value = template.render(**MyConf())
     assert value == u'bar'
+
+
+def test_value_is_cached():
+    calls = []
+
+    class MyConf(BaseConf):
+        @conf
+        def foo(self):
+            calls.append(1)
+            return 'foo'
+
+        bar = '%(foo)s-bar'
+
+    c = MyConf()
+    assert c.bar == 'foo-bar'
+    assert c.bar == 'foo-bar'
+    assert c.foo == 'foo'
+    assert len(calls) == 1
+
+
+def test_set_invalidates_dependent_values():
+    class MyConf(BaseConf):
+        user = 'foo'
+        shared_path = ['/home', '%(user)s', 'shared']
+        media_path = ['%(shared_path)s', 'media']
+        other = 'other'
+
+    c = MyConf()
+    assert c.media_path == '/home/foo/shared/media'
+    assert c.other == 'other'
+
+    c.user = 'bar'
+    assert c.shared_path == '/home/bar/shared'
+    assert c.media_path == '/home/bar/shared/media'
+    assert c.other == 'other'
+
+
+def test_class_templates_are_not_mutated():
+    class MyConf(BaseConf):
+        user = 'foo'
+        home_path = ['/home', '%(user)s']
+
+    assert MyConf().home_path == '/home/foo'
+    c = MyConf()
+    c.user = 'bar'
+    assert c.home_path == '/home/bar'
+
+
+def test_compile_template():
+    template = compile_template('%(home_path)s/%(user)s-100%%')
+    assert template.keys == ('home_path', 'user')
+    assert template.render({'home_path': '/home', 'user': 'foo'}) == \
+        '/home/foo-100%'
+
+    template = compile_template('%Y.%m.%d-%H.%M.%S')
+    assert template.keys == ()
+    assert template.render({}) == '%Y.%m.%d-%H.%M.%S'
+
+
+def test_class_dependency_graph():
+    class MyConf(BaseConf):
+        user = 'foo'
+        home_path = ['/home', '%(user)s']
+        media_path = ['%(home_path)s', 'media']
+
+    assert MyConf._conf_graph['media_path'] == ('home_path',)
+    order = list(MyConf._conf_order)
+    assert order.index('user') < order.index('home_path') < \
+        order.index('media_path')
+
+
+def test_circular_templates():
+    def define():
+        class MyConf(BaseConf):
+            foo = '%(bar)s'
+            bar = ['%(baz)s', '%(foo)s']
+            baz = 'baz'
+
+    assert_raises(CircularVarException, define)
+
+
+def test_conf_keys():
+    class MyTask(Task):
+        @conf
+        def foo(self):
+            return 'task'
+
+    class MyConf(BaseConf):
+        foo = 'conf'
+        bar = '%(foo)s'
+
+    c = MyConf(releases=[])
+    assert sorted(c.keys()) == ['bar', 'foo']
+
+    c.baz = 'baz'
+    child = c.copy()
+    child.add_task(MyTask())
+    child.qux = 'qux'
+    c.quux = 'quux'
+    assert sorted(child.keys()) == ['bar', 'baz', 'foo', 'quux', 'qux']
+    assert len(child) == 5
+    assert sorted(c.keys()) == ['bar', 'baz', 'foo', 'quux']
+
+
+def test_profile_conf():
+    class Conf(BaseConf):
+        name = 'bar'
+        bar_path = ['/home', '%(name)s']
+
+        @conf
+        def slow(self):
+            time.sleep(0.01)
+            return self.bar_path
+
+    c = Conf()
+    with profile_conf() as profile:
+        assert c.slow == '/home/bar'
+        assert c.slow == '/home/bar'
+    c.slow
+
+    slow = profile.keys['slow']
+    assert slow.count == 1
+    assert slow.hits == 1
+    assert slow.sources == {'class': 1}
+    assert slow.own_time >= 0.01
+    assert profile.keys['bar_path'].total_time < slow.total_time
+    assert profile.top(1)[0] is slow
+    assert profile.as_dict()['name']['count'] == 1
@@ -0,0 +1,51 @@
+import time
+import threading
+
+from fabric.api import env
+
+from fabdeploy.containers import DefaultConf
+from fabdeploy.context import local_env
+from fabdeploy.task import Task
+from fabdeploy.containers import conf
+
+
+class SlowTask(Task):
+    @conf
+    def slow_home_path(self):
+        time.sleep(0.01)
+        return self.conf.home_path
+
+    def do(self):
+        return (self.conf.slow_home_path, env.host_string)
+
+slow_task = SlowTask()
+
+
+def test_tasks_run_concurrently_in_local_env():
+    results = {}
+
+    def worker(user):
+        conf = DefaultConf(name=user)
+        conf.address = '%s@localhost' % user
+        with local_env(conf=conf):
+            results[user] = [slow_task.run() for _ in range(5)]
+
+    users = ['user%s' % i for i in range(4)]
+    threads = [threading.Thread(target=worker, args=(u,)) for u in users]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for user in users:
+        expected = ('/home/%s' % user, '%s@localhost' % user)
+        assert results[user] == [expected] * 5
+
+
+def test_local_env_does_not_leak():
+    old_host_string = env.get('host_string')
+    with local_env(host_string='user@example.com'):
+        assert env.host_string == 'user@example.com'
+        env.foo = 'local'
+    assert env.get('host_string') == old_host_string
+    assert 'foo' not in env
@@ -0,0 +1,74 @@
+import os
+import tempfile
+
+from fabric import operations
+from fabric.api import env, run
+
+from fabdeploy import release, users
+from fabdeploy.containers import DefaultConf
+from fabdeploy.counters import counting
+from fabdeploy.task import Task
+
+from .transport import FakeTransport
+
+
+def setup():
+    env.conf = DefaultConf(name='test_counters')
+    env.conf.address = 'deploy@localhost'
+    env.conf.release = '2012.01.01-00.00.00'
+
+
+class Upload(Task):
+    budget = {'commands': 1, 'uploads': 1}
+
+    def do(self):
+        run('true')
+        run('true')
+        operations.put(self.conf.local_file, '/tmp/file')
+
+upload = Upload()
+
+
+def test_counting():
+    setup()
+    f = tempfile.NamedTemporaryFile(delete=False)
+    f.write('x' * 10)
+    f.close()
+
+    with FakeTransport().install():
+        with counting() as counter:
+            upload.run(local_file=f.name)
+    os.remove(f.name)
+
+    assert counter.total.as_dict() == {
+        'commands': 2, 'uploads': 1, 'bytes': 10}
+    assert counter.tasks['test_counters.upload'].commands == 2
+    assert counter.hosts['deploy@localhost'].uploads == 1
+    assert [(v.kind, v.used, v.budget) for v in counter.violations] == [
+        ('commands', 2, 1)]
+
+
+def test_activate_budget():
+    setup()
+    with FakeTransport().install() as transport:
+        with counting() as counter:
+            release.activate.run()
+    assert len(transport.commands) == 1
+    assert counter.tasks['release.activate'].commands == 1
+    assert not counter.violations
+
+
+def test_list_users_budget():
+    setup()
+    transport = FakeTransport({
+        'ls -1 /home': 'alice\r\nbob\r\nold',
+        'cat /etc/passwd': 'root:x:0:0::/root:/bin/bash\n'
+                           'alice:x:1000:1000::/home/alice:/bin/bash\n'
+                           'bob:x:1001:1001::/home/bob:/bin/bash',
+    })
+    with transport.install():
+        with counting() as counter:
+            with users.list_users.tmp_conf():
+                result = users.list_users.get_users(exclude_users=['bob'])
+    assert result == ['root', 'alice']
+    assert counter.total.commands == 2
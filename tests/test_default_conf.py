@@ -30,3 +30,13 @@ def test_update_conf():
     assert conf.db_user == 'fabdeploy'
     assert conf.db_password == 'fabdeploy'
     assert conf.db_host == 'localhost'
+
+
+def test_lazy_release_is_stable():
+    conf = DefaultConf()
+    release = conf.release
+    assert conf.release == release
+    assert conf.release_path.endswith(release)
+
+    conf.release = 'custom'
+    assert conf.release_path == conf.releases_path + '/custom'
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+
+from fabric.api import env
+
+from fabdeploy import digests
+from fabdeploy.containers import DefaultConf, conf
+from fabdeploy.task import Task
+
+from .transport import FakeTransport, write
+
+
+class PushConfig(Task):
+    skip_unchanged = True
+    inputs = ['config']
+    input_templates = ['config_template']
+
+    @conf
+    def config_template(self):
+        return 'test.conf'
+
+    @conf
+    def config(self):
+        return '/etc/test.conf'
+
+    def do(self):
+        self.calls.append(self.conf.config)
+
+push_config = PushConfig()
+
+
+def test_skip_unchanged():
+    templates_lpath = tempfile.mkdtemp()
+    template_lfile = os.path.join(templates_lpath, 'test.conf')
+    write(template_lfile, 'server_name {{ server_name }};\n'
+                          '{% include "base.conf" %}')
+    write(os.path.join(templates_lpath, 'base.conf'), '{{ log_path }}')
+
+    env.conf = DefaultConf(name='test_digests')
+    env.conf.address = 'deploy@localhost'
+    env.conf.config_templates_lpathes = [templates_lpath]
+    PushConfig.calls = []
+    transport = FakeTransport()
+
+    def deploy(**kwargs):
+        digests.forget()
+        del transport.commands[:]
+        with transport.install():
+            push_config.run(**kwargs)
+
+    try:
+        deploy()
+        assert len(PushConfig.calls) == 1
+        assert env.conf.task_digests_file in transport.files
+
+        # no changes, digests file is read once
+        deploy()
+        assert len(PushConfig.calls) == 1
+        assert transport.commands == ['cat %s' % env.conf.task_digests_file]
+
+        # value used by template changed
+        env.conf.server_name = 'example.com'
+        deploy()
+        assert len(PushConfig.calls) == 2
+
+        # included template changed
+        write(os.path.join(templates_lpath, 'base.conf'), 'changed')
+        os.utime(os.path.join(templates_lpath, 'base.conf'), (1, 1))
+        deploy()
+        assert len(PushConfig.calls) == 3
+
+        # task input changed
+        deploy(config='/etc/other.conf')
+        assert len(PushConfig.calls) == 4
+
+        # forced run
+        deploy(config='/etc/other.conf', use_digests='no')
+        assert len(PushConfig.calls) == 5
+        deploy(config='/etc/other.conf')
+        assert len(PushConfig.calls) == 5
+    finally:
+        shutil.rmtree(templates_lpath)
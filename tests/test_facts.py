@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import threading
+
+from fabdeploy.facts import FactsCache
+
+
+def test_facts_cache():
+    dirpath = tempfile.mkdtemp()
+    try:
+        cache = FactsCache(os.path.join(dirpath, 'facts', 'host.json'), 60)
+        cache.set('cpu_count', 4)
+        assert cache.get('cpu_count') == 4
+        assert FactsCache(cache.path, 60).get('cpu_count') == 4
+
+        expired = FactsCache(cache.path, 0)
+        try:
+            expired.get('cpu_count')
+            assert False
+        except KeyError:
+            pass
+
+        cache.clear()
+        assert cache.items() == []
+    finally:
+        shutil.rmtree(dirpath)
+
+
+def test_facts_cache_threads():
+    dirpath = tempfile.mkdtemp()
+    cache = FactsCache(os.path.join(dirpath, 'host.json'), 60)
+    errors = []
+
+    def update(thread):
+        try:
+            for i in range(50):
+                cache.set('fact_%s_%s' % (thread, i), i)
+        except Exception, exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=update, args=(i,)) for i in range(4)]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        items = cache.items()
+        files = os.listdir(dirpath)
+    finally:
+        shutil.rmtree(dirpath)
+
+    assert errors == []
+    assert len(items) == 200
+    assert files == ['host.json']
+
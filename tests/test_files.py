@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+
+from fabric.api import settings
+
+from fabdeploy import files
+
+from .transport import LocalTransport
+
+
+def test_exists_many():
+    dirpath = tempfile.mkdtemp()
+    file = os.path.join(dirpath, "it's a file")
+    with open(file, 'w') as f:
+        f.write('abc')
+    missing = os.path.join(dirpath, 'missing')
+
+    transport = LocalTransport()
+    try:
+        with settings(host_string='deploy@localhost'):
+            with transport.install():
+                exists = files.exists_many([dirpath, file, missing])
+                stats = files.stat_many([dirpath, file, missing])
+    finally:
+        shutil.rmtree(dirpath)
+
+    assert exists == {dirpath: True, file: True, missing: False}
+    assert stats[dirpath]['type'] == 'directory'
+    assert stats[file]['type'] == 'regular file'
+    assert stats[file]['size'] == 3
+    assert stats[missing] is None
+    assert len(transport.commands) == 2
+
+
+def test_exists_many_chunks():
+    transport = LocalTransport()
+    paths = ['/'] + ['/nonexistent/%d' % i for i in range(5)]
+    saved = files.MANY_CHUNK_SIZE
+    files.MANY_CHUNK_SIZE = 2
+    try:
+        with settings(host_string='deploy@localhost'):
+            with transport.install():
+                exists = files.exists_many(paths)
+    finally:
+        files.MANY_CHUNK_SIZE = saved
+
+    assert [p for p in paths if exists[p]] == ['/']
+    assert len(transport.commands) == 3
+
+
+def test_list_dir():
+    dirpath = tempfile.mkdtemp()
+    for name in ['db1.pgc', 'db2.pgc', 'notes.txt']:
+        with open(os.path.join(dirpath, name), 'w') as f:
+            f.write('abcd')
+    os.mkdir(os.path.join(dirpath, 'dir.pgc'))
+
+    transport = LocalTransport()
+    try:
+        with settings(host_string='deploy@localhost'):
+            with transport.install():
+                entries = list(files.list_dir(dirpath))
+                dumps = list(files.list_dir(dirpath, pattern='*.pgc',
+                                            type='f'))
+                matched = list(files.list_dir(dirpath, regex='db[0-9]+\.pgc'))
+    finally:
+        shutil.rmtree(dirpath)
+
+    assert len(entries) == 4
+    entry = [e for e in entries if e['name'] == 'notes.txt'][0]
+    assert entry['path'] == os.path.join(dirpath, 'notes.txt')
+    assert entry['type'] == 'regular file'
+    assert entry['size'] == 4
+    assert entry['mtime'] > 0
+    assert sorted(e['name'] for e in dumps) == ['db1.pgc', 'db2.pgc']
+    assert sorted(e['name'] for e in matched) == ['db1.pgc', 'db2.pgc']
+    assert len(transport.commands) == 3
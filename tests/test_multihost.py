@@ -0,0 +1,71 @@
+import time
+
+from fabric.api import env, abort
+
+from fabdeploy.containers import DefaultConf
+from fabdeploy.multihost import run_tasks
+from fabdeploy.task import Task
+
+
+class HostTask(Task):
+    def do(self):
+        time.sleep(0.01)
+        self.conf.set_globally('host_marker', self.conf.host)
+        return (env.host_string, self.conf.release)
+
+host_task = HostTask()
+
+
+class MarkerTask(Task):
+    def do(self):
+        return self.conf.host_marker
+
+marker_task = MarkerTask()
+
+
+class FailingTask(Task):
+    def do(self):
+        if self.conf.host == 'bad':
+            abort('bad host')
+        return self.conf.host
+
+failing_task = FailingTask()
+
+
+def setup():
+    env.conf = DefaultConf(name='test_multihost')
+    env.conf.address = 'deploy@localhost'
+
+
+def test_hosts_are_isolated():
+    setup()
+    hosts = ['web%s' % i for i in range(8)]
+    results = run_tasks([host_task, marker_task], hosts=hosts, pool_size=4)
+
+    assert [r.host for r in results] == hosts
+    releases = set()
+    for host, r in zip(hosts, results):
+        assert not r.failed
+        assert r.duration is not None
+        host_string, release = r.results[0]
+        assert host_string == 'deploy@%s:22' % host
+        releases.add(release)
+        assert r.result == host
+    # release is resolved once for all hosts
+    assert len(releases) == 1
+    assert 'host_marker' not in env.conf
+
+
+def test_on_error():
+    setup()
+    hosts = ['bad', 'web1', 'web2']
+
+    results = run_tasks(
+        failing_task, hosts=hosts, pool_size=1, on_error='continue')
+    assert [r.failed for r in results] == [True, False, False]
+    assert [r.result for r in results] == [None, 'web1', 'web2']
+
+    results = run_tasks(
+        failing_task, hosts=hosts, pool_size=1, on_error='abort')
+    assert results[0].failed
+    assert [r.skipped for r in results] == [False, True, True]
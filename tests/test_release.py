@@ -0,0 +1,203 @@
+import os
+import json
+import shutil
+import tempfile
+import time
+
+from fabric.api import env
+
+from fabdeploy import release
+from fabdeploy.containers import DefaultConf
+from fabdeploy.counters import counting
+
+from .transport import LocalTransport, write
+
+
+def setup_home():
+    home_path = tempfile.mkdtemp()
+    env.conf = DefaultConf(name='test_release')
+    env.conf.address = 'deploy@localhost'
+    env.conf.home_path = home_path
+    return home_path
+
+
+def test_list_releases():
+    home_path = setup_home()
+    env.conf.release = '2012.01.02-00.00.00'
+    os.makedirs(env.conf.release_path)
+    os.makedirs(os.path.join(env.conf.releases_path, '2012.01.01-00.00.00'))
+    os.makedirs(os.path.join(env.conf.releases_path, '2011.12.31-00.00.00'))
+    os.makedirs(os.path.join(env.conf.releases_path, 'other'))
+
+    transport = LocalTransport()
+    try:
+        with transport.install():
+            release.activate.run(release='2012.01.01-00.00.00')
+            release.activate.run()
+            links = [os.readlink(getattr(env.conf, link)) for link in [
+                'current_release_link', 'last_release_link',
+                'previous_release_link']]
+            with release.list_releases.tmp_conf(env.conf):
+                with counting() as counter:
+                    releases = release.list_releases.read_releases()
+    finally:
+        shutil.rmtree(home_path)
+
+    assert links == [env.conf.release_path, env.conf.release_path,
+                     os.path.join(env.conf.releases_path,
+                                  '2012.01.01-00.00.00')]
+    assert counter.total.commands == 1
+    assert [(r['name'], r['is_tmp']) for r in releases] == [
+        ('2012.01.02-00.00.00', False),
+        ('2012.01.01-00.00.00', False),
+        ('2011.12.31-00.00.00', True),
+    ]
+    data = releases[0]['data']
+    assert data['release'] == '2012.01.02-00.00.00'
+    assert data['duration'] == data['activated'] - 1325462400
+    assert data['commit'] == ''
+    assert data['size'] > 0
+    assert data['latency_us'] >= 0
+    assert releases[2]['data'] == {}
+
+
+def test_activate_release_not_named_by_time():
+    home_path = setup_home()
+    env.conf.release = 'v1.2 "%s"'
+    os.makedirs(env.conf.release_path)
+
+    try:
+        with LocalTransport().install():
+            release.activate.run()
+        with open(env.conf.release_data_file) as f:
+            data = json.load(f)
+    finally:
+        shutil.rmtree(home_path)
+
+    assert data['release'] == 'v1.2 "%s"'
+    assert data['duration'] is None
+
+
+def test_activate_with_stale_previous_tmp():
+    home_path = setup_home()
+    env.conf.release = '2012.01.02-00.00.00'
+    last_path = os.path.join(env.conf.releases_path, '2012.01.01-00.00.00')
+    stale_path = os.path.join(env.conf.releases_path, '2011.12.31-00.00.00')
+    os.makedirs(env.conf.release_path)
+    os.makedirs(last_path)
+    os.makedirs(stale_path)
+    os.symlink(last_path, env.conf.last_release_link)
+    os.symlink(stale_path, env.conf.previous_release_link + '.tmp')
+
+    try:
+        with LocalTransport().install():
+            release.activate.run()
+        previous = os.readlink(env.conf.previous_release_link)
+        stale_contents = os.listdir(stale_path)
+        has_tmp = os.path.lexists(env.conf.previous_release_link + '.tmp')
+    finally:
+        shutil.rmtree(home_path)
+
+    assert previous == last_path
+    assert stale_contents == []
+    assert not has_tmp
+
+
+def test_create_links_env():
+    home_path = setup_home()
+    env.conf.release = '2012.01.02-00.00.00'
+    last_env_path = os.path.join(
+        env.conf.releases_path, '2012.01.01-00.00.00', 'env')
+    write(os.path.join(last_env_path, 'lib', 'module.py'), 'x' * 100)
+    write(os.path.join(last_env_path, 'lib', 'easy-install.pth'), 'x' * 10)
+    write(os.path.join(last_env_path, 'bin', 'activate'), 'x' * 5)
+    os.symlink(os.path.dirname(last_env_path), env.conf.last_release_link)
+    os.makedirs(env.conf.release_path)
+
+    transport = LocalTransport()
+    try:
+        with transport.install():
+            with counting() as counter:
+                result = release.create.run(mode='link')
+        stats = dict(
+            (name, (os.stat(os.path.join(last_env_path, name)).st_ino,
+                    os.stat(os.path.join(env.conf.env_path, name)).st_ino))
+            for name in ['lib/module.py', 'lib/easy-install.pth',
+                         'bin/activate'])
+    finally:
+        shutil.rmtree(home_path)
+
+    assert result == {'copied': 15, 'linked': 100}
+    assert stats['lib/module.py'][0] == stats['lib/module.py'][1]
+    assert stats['lib/easy-install.pth'][0] != \
+        stats['lib/easy-install.pth'][1]
+    assert stats['bin/activate'][0] != stats['bin/activate'][1]
+    assert not counter.violations
+
+
+def test_purge_in_background():
+    home_path = setup_home()
+    names = ['2012.01.01-00.00.00', '2012.01.02-00.00.00']
+    for name in names:
+        for i in range(3):
+            write(os.path.join(env.conf.releases_path, name, 'env', str(i)),
+                  'x')
+
+    transport = LocalTransport()
+    try:
+        with transport.install():
+            with release.purge_tmp.tmp_conf(
+                    env.conf, task_kwargs={'purge_mode': 'background'}):
+                release.purge_tmp.purge(names)
+            assert os.listdir(env.conf.releases_path) == []
+
+            for i in range(50):
+                if not os.listdir(env.conf.trash_path):
+                    break
+                time.sleep(0.1)
+            status = release.purge_status.run()
+    finally:
+        shutil.rmtree(home_path)
+
+    assert status['files'] == 0
+    assert len(transport.commands) == 2
+
+
+def test_purge_old_by_size():
+    home_path = setup_home()
+    names = ['2012.01.0%s-00.00.00' % i for i in range(4, 0, -1)]
+    for name in names:
+        write(os.path.join(env.conf.releases_path, name, 'static'),
+              'x' * 100000)
+    os.symlink(os.path.join(env.conf.releases_path, names[1]),
+               env.conf.current_release_link)
+
+    transport = LocalTransport()
+    try:
+        with transport.install():
+            with release.purge_old.tmp_conf(env.conf):
+                nothing = release.purge_old.plan(names)
+            with release.purge_old.tmp_conf(
+                    env.conf, task_kwargs={'keep_number': 1}):
+                by_number = release.purge_old.plan(names)
+            count_commands = list(transport.commands)
+            with release.purge_old.tmp_conf(
+                    env.conf, task_kwargs={'keep_bytes': '250K'}):
+                by_bytes = release.purge_old.plan(names)[0]
+            with release.purge_old.tmp_conf(
+                    env.conf, task_kwargs={'min_free_bytes': '1000T'}):
+                by_free, sizes, free = release.purge_old.plan(names)
+    finally:
+        shutil.rmtree(home_path)
+
+    # count only policy does not measure sizes
+    assert nothing == ([], None, None)
+    assert by_number == (names[2:], None, None)
+    assert len(count_commands) == 1
+    assert 'du ' not in count_commands[0]
+    assert by_bytes == names[2:]
+    # newest and current releases are kept
+    assert by_free == names[2:]
+    assert sizes[names[0]] > 100000
+    assert free > 0
+    assert len(transport.commands) == 3
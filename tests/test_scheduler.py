@@ -0,0 +1,131 @@
+import sys
+import time
+from StringIO import StringIO
+
+from nose.tools import assert_raises
+from fabric.api import env, puts, abort
+
+from fabdeploy.containers import DefaultConf
+from fabdeploy.scheduler import run_graph, task_graph, CircularTaskException
+from fabdeploy.task import Task
+
+
+events = []
+
+
+class Step(Task):
+    requires = []
+    delay = 0.1
+
+    def do(self):
+        events.append(('start', self.name))
+        for i in range(3):
+            puts('%s %s' % (self.name, i))
+            time.sleep(self.delay / 3)
+        events.append(('finish', self.name))
+        return self.name
+
+
+class PushNginx(Step):
+    pass
+
+push_nginx = PushNginx()
+
+
+class PushSupervisor(Step):
+    pass
+
+push_supervisor = PushSupervisor()
+
+
+class PipInstall(Step):
+    delay = 0.2
+
+pip_install = PipInstall()
+
+
+class Restart(Step):
+    requires = [push_nginx, push_supervisor, pip_install]
+
+restart = Restart()
+
+
+class Broken(Step):
+    def do(self):
+        abort('broken')
+
+broken = Broken()
+
+
+class AfterBroken(Step):
+    requires = [broken]
+
+after_broken = AfterBroken()
+
+
+def setup():
+    env.conf = DefaultConf(name='test_scheduler')
+    env.conf.address = 'deploy@localhost'
+    del events[:]
+
+
+def run(tasks, concurrency=4):
+    stdout = sys.stdout
+    sys.stdout = output = StringIO()
+    try:
+        return run_graph(tasks, concurrency=concurrency, preconnect=False)
+    finally:
+        sys.stdout = stdout
+        run.output = output.getvalue()
+
+
+def test_task_graph():
+    order, graph = task_graph([restart])
+    assert order == [push_nginx, push_supervisor, pip_install, restart]
+    assert graph[restart] == set([push_nginx, push_supervisor, pip_install])
+
+
+def test_circular_requirements():
+    class A(Step):
+        pass
+
+    class B(Step):
+        pass
+
+    a, b = A(), B()
+    a.requires = [b]
+    b.requires = [a]
+    assert_raises(CircularTaskException, task_graph, [a])
+
+
+def test_independent_tasks_run_concurrently():
+    setup()
+    results = run([restart])
+
+    assert [r.result for r in results] == [
+        'push_nginx', 'push_supervisor', 'pip_install', 'restart']
+    # pushes run together with pip_install, restart waits for all
+    assert events.index(('start', 'pip_install')) < \
+        events.index(('finish', 'push_nginx'))
+    assert events.index(('start', 'restart')) == 6
+
+    # output is grouped by task in dependency order
+    lines = [l.split('] ')[-1] for l in run.output.splitlines()]
+    assert lines == ['%s %s' % (r.result, i)
+                     for r in results for i in range(3)]
+
+
+def test_concurrency_cap():
+    setup()
+    run([restart], concurrency=1)
+    assert events == [
+        ('start', 'push_nginx'), ('finish', 'push_nginx'),
+        ('start', 'push_supervisor'), ('finish', 'push_supervisor'),
+        ('start', 'pip_install'), ('finish', 'pip_install'),
+        ('start', 'restart'), ('finish', 'restart')]
+
+
+def test_failed_task_skips_dependents():
+    setup()
+    assert_raises(SystemExit, run, [after_broken, push_nginx])
+    assert ('start', 'after_broken') not in events
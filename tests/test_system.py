@@ -1,6 +1,13 @@
+import shutil
+import tempfile
 import multiprocessing
 
+from fabric.api import env
+
 from fabdeploy import system
+from fabdeploy.containers import DefaultConf
+
+from .transport import LocalTransport
 
 
 def test_cpu_count():
@@ -12,3 +19,37 @@ def test_cpu_count():
 def test_os_codename():
     with system.os_codename.tmp_conf():
         assert system.os_codename.os_codename() != None
+
+
+def test_os_codename_from_dist():
+    assert system.os_codename_from_dist('Ubuntu', '12.04', 'precise') == \
+        'precise'
+    assert system.os_codename_from_dist('debian', '6.0.4', '') == 'squeeze'
+    assert system.os_codename_from_dist('unknown', '1.0', '') is None
+
+
+def test_facts_code_is_shell_safe():
+    code = system.FACTS_CODE % {'home_path': '/home/user', 'packages': []}
+    for c in ['"', '$', '`']:
+        assert c not in code
+
+
+def test_gather_facts():
+    env.conf = DefaultConf(name='test_system')
+    env.conf.address = 'deploy@localhost'
+    env.conf.home_path = tempfile.gettempdir()
+    env.conf.facts_cache_lpath = tempfile.mkdtemp()
+    transport = LocalTransport()
+    try:
+        with transport.install():
+            with system.facts.tmp_conf(env.conf):
+                facts = system.facts.gather()
+    finally:
+        shutil.rmtree(env.conf.facts_cache_lpath)
+
+    assert sorted(facts) == sorted(system.Facts.NAMES)
+    assert facts['cpu_count'] == multiprocessing.cpu_count()
+    assert facts['mem_total'] > 0
+    assert facts['disk_free'] > 0
+    assert isinstance(facts['installed_packages'], dict)
+    assert len(transport.commands) == 1
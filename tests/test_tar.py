@@ -0,0 +1,91 @@
+import os
+import shutil
+import socket
+import tempfile
+import subprocess
+
+from fabric.api import env, settings
+
+from fabdeploy import tar
+from fabdeploy.containers import DefaultConf
+from fabdeploy.counters import counting
+
+from .transport import write
+
+
+class LocalChannel(object):
+    """SSH channel replacement that runs command locally."""
+
+    def set_combine_stderr(self, combine):
+        pass
+
+    def exec_command(self, command):
+        self.process = subprocess.Popen(
+            command, shell=True, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def sendall(self, data):
+        try:
+            self.process.stdin.write(data)
+        except IOError, exc:
+            raise socket.error(str(exc))
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def recv(self, size):
+        return os.read(self.process.stdout.fileno(), size)
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def close(self):
+        self.process.stdout.close()
+
+
+def test_stream_push():
+    src_path = tempfile.mkdtemp()
+    target_path = tempfile.mkdtemp()
+    write(os.path.join(src_path, 'app', 'models.py'), 'x' * 1000)
+    write(os.path.join(src_path, 'app', 'models.pyc'), 'x')
+    write(os.path.join(src_path, 'README'), 'readme')
+    os.mkdir(os.path.join(target_path, 'f'))
+
+    env.conf = DefaultConf(name='test_tar')
+    env.conf.address = 'deploy@localhost'
+    saved = tar._open_channel
+    tar._open_channel = LocalChannel
+    try:
+        with settings(host_string='deploy@localhost'):
+            with counting() as counter:
+                tar.push.run(release_path=src_path, target_path=target_path)
+            tar.push_files.run(release_path=src_path, files='README',
+                               target_path=os.path.join(target_path, 'f'))
+        pushed = sorted(
+            os.path.relpath(os.path.join(dirpath, f), target_path)
+            for dirpath, _, filenames in os.walk(target_path)
+            for f in filenames)
+    finally:
+        tar._open_channel = saved
+        shutil.rmtree(src_path)
+        shutil.rmtree(target_path)
+
+    assert pushed == ['README', 'app/models.py', 'f/README']
+    assert counter.total.commands == 1
+    assert counter.total.bytes > 0
+
+
+def test_stream_remote_failure():
+    saved = tar._open_channel
+    tar._open_channel = LocalChannel
+    try:
+        with settings(host_string='deploy@localhost'):
+            try:
+                tar.stream_command('yes | head -c 1000000',
+                                   'cd /nonexistent && cat')
+            except SystemExit:
+                pass
+            else:
+                assert False, 'SystemExit was not raised'
+    finally:
+        tar._open_channel = saved
@@ -72,3 +72,47 @@ def test_task_called_with_conf_of_another_task():
 
     task0 = Task0()
     task0.run(bar='task0')
+
+
+@with_setup(setup, teardown)
+def test_task_conf_is_layered_on_env_conf():
+    class MyTask(Task):
+        pass
+    my_task = MyTask()
+
+    with my_task.tmp_conf():
+        env.conf.foo = 'env'
+        assert my_task.conf.foo == 'env'
+
+        my_task.conf.foo = 'task'
+        assert my_task.conf.foo == 'task'
+        assert env.conf.foo == 'env'
+
+        my_task.conf.set_globally('bar', 'global')
+        assert env.conf.bar == 'global'
+
+
+@with_setup(setup, teardown)
+def test_task_conf_sees_global_changes_of_cached_values():
+    class MyTask(Task):
+        pass
+    my_task = MyTask()
+
+    env.conf.address = 'user1@localhost'
+    with my_task.tmp_conf():
+        assert my_task.conf.home_path == '/home/user1'
+        env.conf.address = 'user2@localhost'
+        assert my_task.conf.home_path == '/home/user2'
+
+
+@with_setup(setup, teardown)
+def test_task_namespaces():
+    class LogTask(Task):
+        pass
+    log_task = LogTask()
+
+    env.conf.log_task__log_path = '/var/log/log_task'
+    with log_task.tmp_conf():
+        assert log_task.conf.log_path == '/var/log/log_task'
+    with example_task.tmp_conf():
+        assert example_task.conf.log_path == env.conf.log_path
@@ -0,0 +1,64 @@
+import os
+import json
+import tempfile
+
+from fabric.api import env
+from fabric.operations import _AttributeString
+
+from fabdeploy import monkey
+from fabdeploy.containers import DefaultConf
+from fabdeploy.task import Task
+from fabdeploy.trace import tracing
+
+
+class Inner(Task):
+    def do(self):
+        return monkey._patched_run_command('echo inner')
+
+inner = Inner()
+
+
+class Outer(Task):
+    def do(self):
+        return inner.run()
+
+outer = Outer()
+
+
+def fake_run_command(command, **kwargs):
+    out = _AttributeString('')
+    out.return_code = 0
+    return out
+
+
+def test_tracing():
+    env.conf = DefaultConf(name='test_trace')
+    env.conf.address = 'deploy@localhost'
+    path = tempfile.mktemp(suffix='.json')
+
+    old_run_command = monkey._run_command
+    monkey._run_command = fake_run_command
+    try:
+        with tracing(path):
+            outer.run()
+    finally:
+        monkey._run_command = old_run_command
+
+    with open(path) as f:
+        events = json.load(f)['traceEvents']
+    os.remove(path)
+
+    assert events[0]['ph'] == 'M'
+    spans = [e for e in events if e['ph'] == 'X']
+    assert [(e['name'], e['cat']) for e in spans] == [
+        ('test_trace.outer', 'task'),
+        ('test_trace.inner', 'task'),
+        ('echo inner', 'run'),
+    ]
+    outer_span, inner_span, command_span = spans
+    assert outer_span['args']['host'] == 'deploy@localhost'
+    assert command_span['args']['return_code'] == 0
+    # spans are nested
+    for parent, child in [(outer_span, inner_span), (inner_span, command_span)]:
+        assert parent['ts'] <= child['ts']
+        assert child['ts'] + child['dur'] <= parent['ts'] + parent['dur']
@@ -1,7 +1,45 @@
-from fabdeploy.utils import unprefix_conf
+from fabdeploy.containers import BaseConf
+from fabdeploy.utils import unprefix_conf, split_lines, parse_size, \
+    format_size
 
 
 def test_unprefix_conf():
     conf = {'module__foo': 'module', 'foo': 'bar'}
     unprefix_conf(conf, ['module__'])
     assert conf['foo'] == 'module'
+
+
+def test_unprefix_base_conf():
+    class MyConf(BaseConf):
+        foo = 'bar'
+        module__foo = 'module'
+        module__task__foo = 'module-task'
+        log_path = '/var/log'
+        task__log_path = ['%(log_path)s', 'task']
+
+    conf = MyConf()
+    conf.unprefix(['module__'])
+    assert conf.foo == 'module'
+    assert conf.task__foo == 'module-task'
+
+    conf.unprefix(['task__'])
+    assert conf.foo == 'module-task'
+    assert conf.log_path == '/var/log/task'
+
+    conf.module__foo = 'changed'
+    assert conf['module__foo'] == 'changed'
+
+
+def test_split_lines():
+    assert list(split_lines('a\r\nb\n\nc')) == ['a', 'b', '', 'c']
+    assert list(split_lines('')) == ['']
+
+
+def test_parse_size():
+    assert parse_size(None) is None
+    assert parse_size(10) == 10
+    assert parse_size('512') == 512
+    assert parse_size('2K') == 2048
+    assert parse_size('1.5GB') == 1536 * 1024 * 1024
+    assert format_size(1536 * 1024 * 1024) == '1.5GB'
+    assert format_size(10) == '10B'
@@ -0,0 +1,98 @@
+import os
+import subprocess
+from contextlib import contextmanager
+
+from fabric import operations
+from fabric.contrib import files
+from fabric.operations import _AttributeString
+
+from fabdeploy import monkey
+
+
+class FakeTransport(object):
+    """Local replacement of remote calls that are made through monkey."""
+
+    def __init__(self, outputs=None):
+        self.outputs = outputs or {}
+        # remote path -> content of files uploaded from file-like objects
+        self.files = {}
+        self.commands = []
+        self.uploads = []
+        # state of SSH transport, see FakeClient
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+    def run_command(self, command, **kwargs):
+        self.commands.append(command)
+        return_code = 0
+        if command in self.outputs:
+            out = self.outputs[command]
+        elif command.startswith('cat ') and command[4:] in self.files:
+            out = self.files[command[4:]]
+        elif command.startswith('cat '):
+            out, return_code = 'No such file or directory', 1
+        else:
+            out = ''
+        out = _AttributeString(out)
+        out.return_code = return_code
+        out.failed = return_code != 0
+        out.succeeded = not out.failed
+        return out
+
+    def put(self, local_path=None, remote_path=None, **kwargs):
+        self.uploads.append((local_path, remote_path))
+        if hasattr(local_path, 'read'):
+            self.files[remote_path] = local_path.read()
+        return [remote_path]
+
+    @contextmanager
+    def install(self):
+        saved = (operations._run_command, operations.put, files.put,
+                 monkey._run_command, monkey.put)
+        monkey.patch_all()
+        monkey._run_command = self.run_command
+        monkey.put = self.put
+        try:
+            yield self
+        finally:
+            (operations._run_command, operations.put, files.put,
+             monkey._run_command, monkey.put) = saved
+
+
+class LocalTransport(FakeTransport):
+    """Transport that runs commands with local shell."""
+
+    def run_command(self, command, *args, **kwargs):
+        self.commands.append(command)
+        p = subprocess.Popen(['sh', '-c', command], stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+        out = p.communicate()[0].rstrip('\n')
+        out = _AttributeString(out)
+        out.return_code = p.returncode
+        out.failed = p.returncode != 0
+        out.succeeded = not out.failed
+        return out
+
+
+class FakeClient(object):
+    """SSH client replacement, its transport is :class:`FakeTransport`."""
+
+    def __init__(self):
+        self.transport = FakeTransport()
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.transport.active = False
+
+
+def write(path, data):
+    """Write local file, creating its directory."""
+    dirpath = os.path.dirname(path)
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    with open(path, 'w') as f:
+        f.write(data)